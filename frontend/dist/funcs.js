@@ -1,28 +1,84 @@
 /* global turf loadPyodide */
 
 export const getHex = async (config, infra, parVals, model) => {
+  // tiles are loaded once the map knows what's in view (see `loadTiles`)
+  if (useTiles(config)) {
+    await model.load([]);
+    return turf.featureCollection([]);
+  }
   let hex = await fetch(config.data).then((res) => res.json());
   infra.forEach((obj) => {
     hex = makeOrigProps(hex, obj.col);
   });
-  hex = updateHex(parVals, hex, model);
+  await model.load(hex.features.map((f) => f.properties));
+  hex = await updateHex(parVals, hex, model);
   return hex;
 };
 
+// with `tiles` in the config (made by `spi --tiles`), only the hexes in view
+// are loaded and run through the model (the server model uses `data` instead)
+export const useTiles = (config) => Boolean(config.tiles) && !config.server;
+
+export const getTiles = async (config) => {
+  const url = config.tiles.replace(/\/$/, "");
+  const manifest = await fetch(`${url}/manifest.json`).then((res) => res.json());
+  return { ...manifest, url, loaded: new Set() };
+};
+
+const inView = (bounds, [west, south, east, north]) =>
+  west <= bounds.getEast() &&
+  east >= bounds.getWest() &&
+  south <= bounds.getNorth() &&
+  north >= bounds.getSouth();
+
+// add the tiles in view that haven't been loaded yet, and run the model
+// on all the loaded hexes (drawn lines only change hexes already loaded)
+export const loadTiles = (map, app, model, tiles) => {
+  // one at a time, so each adds to the hexes the last one loaded
+  tiles.queue = (tiles.queue || Promise.resolve())
+    .then(() => addTiles(map, app, model, tiles))
+    .catch((e) => console.error(e));
+  return tiles.queue;
+};
+
+const addTiles = async (map, app, model, tiles) => {
+  const bounds = map.getBounds();
+  const todo = tiles.tiles.filter(
+    (t) => !tiles.loaded.has(t.cell) && inView(bounds, t.bounds)
+  );
+  if (todo.length === 0) return;
+  todo.forEach((t) => tiles.loaded.add(t.cell));
+  const fcs = await Promise.all(
+    todo.map((t) => fetch(`${tiles.url}/${t.file}`).then((res) => res.json()))
+  );
+  let added = turf.featureCollection(fcs.flatMap((fc) => fc.features));
+  app.infra.forEach((obj) => {
+    added = makeOrigProps(added, obj.col);
+  });
+  const hex = { ...app.hex, features: app.hex.features.concat(added.features) };
+  await model.load(hex.features.map((f) => f.properties));
+  app.hex = await updateHex(app.parVals, hex, model);
+  reloadHex(map, app.hex, app.mapLoaded);
+};
+
 export const reloadHex = (map, hex, mapLoaded) => {
   if (mapLoaded) {
     map.getSource("hex").setData(hex);
   }
 };
 
-export const updateHex = (parVals, hex, model) => {
-  return {
-    ...hex,
-    features: hex.features.map((f) => ({
-      ...f,
-      properties: { ...f.properties, ...model(f.properties, parVals) },
-    })),
-  };
+// only the hexes that the model has re-run are replaced
+export const updateHex = async (parVals, hex, model) => {
+  const { rows, results } = await model.run(parVals);
+  if (rows.length === 0) return hex;
+  const features = hex.features.slice();
+  rows.forEach((i, j) => {
+    features[i] = {
+      ...features[i],
+      properties: { ...features[i].properties, ...results[j] },
+    };
+  });
+  return { ...hex, features };
 };
 
 const resetProp = (hex, col) => {
@@ -51,13 +107,20 @@ export const makeOrigProps = (hex, col) => {
   };
 };
 
-export const getColorByMinMax = (attr, scaleColors, hex) => {
-  let min = attr.min;
-  let max = attr.max;
-  if (scaleColors && "features" in hex) {
-    const hexVals = hex.features.map((f) => f.properties[attr.col]);
-    min = Math.min(...hexVals);
-    max = Math.max(...hexVals);
+// `stats` has the min and max of the columns in the hex data, if known
+// (from the tiles manifest), so they don't need to be found every time
+export const getColorByMinMax = (attr, scaleColors, hex, stats) => {
+  if (!scaleColors) return { min: attr.min, max: attr.max };
+  if (stats && stats[attr.col] && stats[attr.col].min !== null) {
+    return stats[attr.col];
+  }
+  if (!("features" in hex)) return { min: attr.min, max: attr.max };
+  let min = Infinity;
+  let max = -Infinity;
+  for (const f of hex.features) {
+    const val = f.properties[attr.col];
+    if (val < min) min = val;
+    if (val > max) max = val;
   }
   return { min, max };
 };
@@ -81,7 +144,7 @@ const zipflat = (a, b) =>
     .reduce((k, i) => k.concat(i))
     .concat(b.slice(-1));
 
-export const updatePaint = (attr, map, scaleColors, hex) => {
+export const updatePaint = (attr, map, scaleColors, hex, stats) => {
   if ("cats" in attr) {
     map.setPaintProperty(
       "hex",
@@ -91,7 +154,7 @@ export const updatePaint = (attr, map, scaleColors, hex) => {
         .concat(zipflat(attr.cats, attr.colors))
     );
   } else {
-    const minMax = getColorByMinMax(attr, scaleColors, hex);
+    const minMax = getColorByMinMax(attr, scaleColors, hex, stats);
     map.setPaintProperty("hex", "fill-color", [
       "interpolate",
       ["linear"],
@@ -104,27 +167,6 @@ export const updatePaint = (attr, map, scaleColors, hex) => {
   }
 };
 
-const extendProp = (ids, dist, col, hexOrig, hexSize) => {
-  let hex = hexOrig;
-  const neis = [];
-  ids.forEach((i) => {
-    try {
-      if (hex.features[i].properties[col] > dist) {
-        hex.features[i].properties[col] = dist;
-        const p = hex.features[i].properties;
-        const nei = [p.n0, p.n1, p.n2, p.n3, p.n4, p.n5];
-        neis.push(nei);
-      }
-    } catch (e) {} // eslint-disable-line
-  });
-  if (neis.length > 0) {
-    const idsSet = new Set(ids);
-    const newIds = [...new Set(neis.flat(1))].filter((x) => !idsSet.has(x));
-    hex = extendProp(newIds, dist + hexSize, col, hex, hexSize);
-  }
-  return hex;
-};
-
 export const emptyFc = () => turf.featureCollection([]);
 
 export const layerPaint = (i) =>
@@ -179,16 +221,19 @@ const getPointsFromGeom = (newGeom) => {
   }
 };
 
+// the rows (not the `index`, which differs when only some tiles are loaded)
+// of the hexes under a drawing
 const joinLineToHex = (newGeom, hex) => {
   const points = getPointsFromGeom(newGeom);
   const tagged = turf
     .tag(points, hex, "index", "hexId")
     .features.map((f) => f.properties.hexId);
   const ids = [...new Set(tagged)].filter(Number);
-  return ids;
+  const rows = new Map(hex.features.map((f, i) => [f.properties.index, i]));
+  return ids.map((id) => rows.get(id)).filter((i) => i !== undefined);
 };
 
-export const updateLine = (
+export const updateLine = async (
   feats,
   app,
   map,
@@ -204,8 +249,11 @@ export const updateLine = (
       .getSource(`drawn_${drawing}`)
       .setData(turf.featureCollection(drawnLines[drawing]));
     const ids = feats.map((f) => joinLineToHex(f.geometry, app.hex)).flat(1);
-    extendProp(ids, 0, drawing, app.hex, hexSize);
-    app.hex = updateHex(app.parVals, app.hex, model);
+    const { rows, values } = await model.draw(drawing, ids, hexSize);
+    rows.forEach((i, j) => {
+      app.hex.features[i].properties[drawing] = values[j];
+    });
+    app.hex = await updateHex(app.parVals, app.hex, model);
     reloadHex(map, app.hex, mapLoaded);
   }
 };
@@ -230,7 +278,7 @@ export const setDrawing = (drawing, draw, infra) => {
   }
 };
 
-export const deleteDrawing = (
+export const deleteDrawing = async (
   col,
   map,
   app,
@@ -243,29 +291,173 @@ export const deleteDrawing = (
   draw.deleteAll();
   drawnLines[col] = [];
   app.hex = resetProp(app.hex, col);
-  app.hex = updateHex(app.parVals, app.hex, model);
+  await setRows(model, app.hex, col, app.hex.features.map((_, i) => i));
+  app.hex = await updateHex(app.parVals, app.hex, model);
   reloadHex(map, app.hex, mapLoaded);
 };
 
-export const getModel = async (config) => {
+const setRows = (model, hex, col, rows) =>
+  model.set(col, rows, rows.map((i) => hex.features[i].properties[col]));
+
+// the model runs in the browser with Pyodide,
+// or on a `spi serve` server if the config has a `server`
+export const getModel = async (config) =>
+  config.server ? getServerModel(config) : getPyodideModel(config);
+
+const getPyodideModel = async (config) => {
   const pyodide = await loadPyodide({fullStdLib: false});
+  await pyodide.loadPackage("numpy");
   const pyModelText = await (await fetch(config.model)).text();
   pyodide.runPython(pyModelText);
-  const model = pyodide.globals.get("model");
-  return (town, pars) =>
-    Object.fromEntries(
-      model(
-        pyodide.toPy(convToNumbers(town)),
-        pyodide.toPy(convToNumbers(pars))
-      ).toJs()
-    );
+  for (const name of ["propagate", "session"]) {
+    const text = await (await fetch(`./models/${name}.py`)).text();
+    pyodide.FS.writeFile(`/home/pyodide/${name}.py`, text);
+  }
+  const ModelSession = pyodide.runPython(
+    "from session import ModelSession\nModelSession"
+  );
+  const modelBatch = pyodide.globals.get("model_batch");
+
+  // the session keeps the hex properties and results on the Python side,
+  // so only hexes that have changed need to be sent and re-run
+  let session = null;
+  const withPy = (vals, fn) => {
+    const args = vals.map((v) => pyodide.toPy(v));
+    const out = fn(...args);
+    args.forEach((p) => p.destroy());
+    return out;
+  };
+  return Object.freeze({
+    // load the properties of every hex
+    load: (towns) => {
+      if (session) session.destroy();
+      session = withPy([toColumns(towns)], (cols) =>
+        ModelSession(modelBatch, cols)
+      );
+    },
+    // update one property for some hexes
+    set: (col, rows, values) => {
+      withPy([rows, values.map(convToNumber)], (r, v) =>
+        session.set_rows(col, r, v)
+      );
+    },
+    // set a property to 0 under a drawing and spread it outwards
+    draw: (col, ids, hexSize) => {
+      const outPy = withPy([ids], (i) => session.draw(col, i, hexSize));
+      const out = outPy.toJs({ dict_converter: Object.fromEntries });
+      outPy.destroy();
+      return out;
+    },
+    // re-run the model where needed and get the new results
+    run: (pars) => {
+      const rowsPy = withPy([convToNumbers(pars)], (p) => session.run(p));
+      const listPy = rowsPy.tolist();
+      const outPy = session.get_rows(rowsPy);
+      const rows = listPy.toJs();
+      const cols = outPy.toJs({ dict_converter: Object.fromEntries });
+      [rowsPy, listPy, outPy].forEach((p) => p.destroy());
+      const keys = Object.keys(cols);
+      const results = rows.map((_, j) =>
+        Object.fromEntries(keys.map((k) => [k, cols[k][j]]))
+      );
+      return { rows, results };
+    },
+  });
+};
+
+// the server keeps the hex properties as they are in the data file,
+// so only those changed by drawing are sent with each request
+const getServerModel = (config) => {
+  const url = `${config.server.replace(/\/$/, "")}/${config.name}`;
+  let orig = {};
+  let edits = {};
+  let last = null;
+  const setEdit = (col, row, val) => {
+    edits[col] = edits[col] || {};
+    if (orig[col][row] === val) delete edits[col][row];
+    else edits[col][row] = val;
+  };
+  const post = async (action, body) => {
+    const res = await fetch(`${url}/${action}`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(body),
+    });
+    if (!res.ok) throw new Error(`${action}: ${await res.text()}`);
+    return res;
+  };
+  return Object.freeze({
+    load: (towns) => {
+      orig = toColumns(towns);
+      edits = {};
+      last = null;
+    },
+    set: (col, rows, values) => {
+      rows.forEach((r, j) => setEdit(col, r, convToNumber(values[j])));
+    },
+    draw: async (col, ids, hexSize) => {
+      const res = await post("draw", { col, rows: ids, step: hexSize, edits });
+      const out = await res.json();
+      out.rows.forEach((r, j) => setEdit(col, r, out.values[j]));
+      return out;
+    },
+    // the server sends every hex, so only those that differ from
+    // the last results are passed on to be updated
+    run: async (pars) => {
+      const res = await post("run", { pars: convToNumbers(pars), edits });
+      const cols = decodeColumns(await res.arrayBuffer());
+      const keys = Object.keys(cols);
+      const n = keys.length > 0 ? cols[keys[0]].length : 0;
+      const rows = [];
+      for (let i = 0; i < n; i++) {
+        if (!last || keys.some((k) => !Object.is(last[k][i], cols[k][i]))) {
+          rows.push(i);
+        }
+      }
+      last = cols;
+      const results = rows.map((i) =>
+        Object.fromEntries(keys.map((k) => [k, cols[k][i]]))
+      );
+      return { rows, results };
+    },
+  });
+};
+
+// read the columns sent by the server (see `encode` in prep/spider/server.py)
+const decodeColumns = (buffer) => {
+  const headerLength = new DataView(buffer).getUint32(0, true);
+  const header = JSON.parse(
+    new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength))
+  );
+  const start = 4 + headerLength;
+  return Object.fromEntries(
+    header.columns.map((c) => {
+      if (c.type === "float64") {
+        return [c.name, new Float64Array(buffer, start + c.offset, header.n)];
+      }
+      const codes = new Int32Array(buffer, start + c.offset, header.n);
+      return [c.name, Array.from(codes, (i) => (i < 0 ? null : c.cats[i]))];
+    })
+  );
+};
+
+const toColumns = (towns) =>
+  Object.fromEntries(
+    Object.keys(towns[0] || {}).map((k) => [
+      k,
+      towns.map((t) => convToNumber(t[k])),
+    ])
+  );
+
+const convToNumber = (val) => {
+  const num = Number(val);
+  return isNaN(num) ? val : num;
 };
 
 const convToNumbers = (obj) => {
   const res = {};
   for (const k in obj) {
-    const num = Number(obj[k]);
-    res[k] = isNaN(num) ? obj[k] : num;
+    res[k] = convToNumber(obj[k]);
   }
   return res;
 };
@@ -3,6 +3,8 @@
 import {
   getModel,
   getHex,
+  getTiles,
+  useTiles,
   updateHex,
   reloadHex,
   deleteDrawing,
@@ -37,6 +39,7 @@ const initApp = (config) => {
         colorBy: config.attrs[0].col,
         drawing: null,
         drawnLines: toObjArr(config.infra),
+        stats: null,
       };
     },
     computed: {
@@ -53,7 +56,8 @@ const initApp = (config) => {
         const minMax = getColorByMinMax(
           this.colorByObj,
           this.scaleColors,
-          this.hex
+          this.hex,
+          this.stats
         );
         return { min: fmt(minMax.min), max: fmt(minMax.max) };
       },
@@ -72,19 +76,23 @@ const initApp = (config) => {
         );
       },
       scaleColors: function () {
-        updatePaint(this.colorByObj, this.map, this.scaleColors, this.hex);
+        this.repaint();
       },
       parVals: function () {
         this.debouncedUpdate();
       },
       colorBy: function () {
-        updatePaint(this.colorByObj, this.map, this.scaleColors, this.hex);
+        this.repaint();
       },
     },
     created: async function () {
       this.debouncedUpdate = _.debounce(this.update, 500);
 
       this.model = await getModel(config);
+      if (useTiles(config)) {
+        this.tiles = await getTiles(config);
+        this.stats = this.tiles.columns;
+      }
 
       this.hex = await getHex(config, this.infra, this.parVals, this.model);
       this.map = makeMap(config, this, this.model);
@@ -114,8 +122,17 @@ const initApp = (config) => {
         );
         this.drawing = null;
       },
-      update: function () {
-        this.hex = updateHex(this.parVals, this.hex, this.model);
+      repaint: function () {
+        updatePaint(
+          this.colorByObj,
+          this.map,
+          this.scaleColors,
+          this.hex,
+          this.stats
+        );
+      },
+      update: async function () {
+        this.hex = await updateHex(this.parVals, this.hex, this.model);
         reloadHex(this.map, this.hex, this.mapLoaded);
       },
       downloadHex: function () {
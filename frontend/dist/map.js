@@ -1,10 +1,10 @@
 /* global mapboxgl MapboxDraw */
 
 import {
+  loadTiles,
   updateHex,
   reloadHex,
   fmt,
-  updatePaint,
   layerPaint,
   updateLine,
   keepDrawing,
@@ -48,7 +48,7 @@ export const makeDraw = (map, app, config, model) => {
   return draw;
 };
 
-export const onMapLoaded = (map, infra, popup, app, model) => {
+export const onMapLoaded = async (map, infra, popup, app, model) => {
   infra.forEach((i) => {
     const id = `drawn_${i.col}`;
     map.addSource(id, {
@@ -108,9 +108,14 @@ export const onMapLoaded = (map, infra, popup, app, model) => {
       "text-color": "#000",
     },
   });
-  app.hex = updateHex(app.parVals, app.hex, model);
-  reloadHex(map, app.hex, true);
-  updatePaint(app.colorByObj, map, app.scaleColors, app.hex);
+  if (app.tiles) {
+    await loadTiles(map, app, model, app.tiles);
+    map.on("moveend", () => loadTiles(map, app, model, app.tiles));
+  } else {
+    app.hex = await updateHex(app.parVals, app.hex, model);
+    reloadHex(map, app.hex, true);
+  }
+  app.repaint();
 
   const pointer = () => {
     if (!app.drawing) map.getCanvas().style.cursor = "pointer";
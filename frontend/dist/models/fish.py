@@ -1,4 +1,7 @@
-from typing import TypedDict
+from functools import lru_cache
+from typing import Optional, TypedDict
+
+import numpy as np
 
 
 class Town(TypedDict):
@@ -59,6 +62,23 @@ class C:
     ]
 
 
+Columns = dict[str, np.ndarray]
+
+
+class FarmCosts(TypedDict):
+    land_rent: float  # USD/ton/yr
+    farm_annual: float  # USD/ton/yr
+    running_costs: float  # USD/ton/yr
+    revenue_per_ton: float  # USD/ton/yr
+
+
+class Prepared(TypedDict):
+    npv: float
+    mg_repayment: float  # USD/ton/yr
+    equipment_annual: float  # USD/ton/yr
+    farm: dict[str, FarmCosts]  # for each of cage and pond
+
+
 class Result(TypedDict):
     tech: str
     fish_output: float
@@ -122,10 +142,11 @@ def calc_npv(yrs: float, r: float) -> float:
 
     Returns: NPV in USD/yr
     """
-    tot = 0.0
-    for i in range(int(yrs)):
-        tot += 1 / (1 + r) ** i
-    return tot
+    # sum of 1 / (1 + r) ** i for i in 0..n-1, as a geometric series
+    n = max(int(yrs), 0)
+    if r == 0:
+        return float(n)
+    return (1 - (1 + r) ** -n) / (1 - 1 / (1 + r))
 
 
 def get_road_type(town: Town, pars: Pars, farm_type: str, fish_output: float) -> str:
@@ -221,11 +242,20 @@ def get_elec_capex(town: Town, pars: Pars) -> float:
         return mg_cost + conn_cost
 
 
-def get_elec_cost_for_farm(town: Town, pars: Pars, npv: float) -> float:
+def get_mg_repayment(pars: Pars, npv: float) -> float:
     """
     Returns: USD/ton/yr
     """
     total_power_req = max(2, pars["ice_power"] + pars["aeration_power"])  # kW/ton
+    mg_cap_cost = pars["mg_cost_pkw"] * total_power_req
+    mg_repayment = mg_cap_cost / npv
+    return mg_repayment
+
+
+def get_elec_cost_for_farm(town: Town, prep: Prepared) -> float:
+    """
+    Returns: USD/ton/yr
+    """
     if town["grid_dist"] < 1:
         # already grid-connected
         return 0
@@ -233,9 +263,7 @@ def get_elec_cost_for_farm(town: Town, pars: Pars, npv: float) -> float:
         # close enough to extend grid
         return 0
     else:
-        mg_cap_cost = pars["mg_cost_pkw"] * total_power_req
-        mg_repayment = mg_cap_cost / npv
-        return mg_repayment
+        return prep["mg_repayment"]
 
 
 def get_farm_cap_cost_annual(pars: Pars, farm_type: str, npv: float) -> float:
@@ -341,23 +369,52 @@ def get_social_benefit(town: Town) -> float:
     return total_social_benefit
 
 
-def model(town: Town, pars: Pars) -> Result:
+def prepare(pars: Pars) -> Prepared:
+    """
+    Calculate everything that depends only on `pars`, once per parameter set
+    (the last few are remembered), to be passed on to `model`/`model_batch`.
+    """
+    return _prepare(tuple(pars.items()))
+
+
+@lru_cache(maxsize=16)
+def _prepare(items: tuple) -> Prepared:
+    pars: Pars = dict(items)  # type: ignore[assignment]
+    npv = calc_npv(pars["duration"], pars["interest_rate"])
+    return Prepared(
+        npv=npv,
+        mg_repayment=get_mg_repayment(pars, npv),
+        equipment_annual=get_equipment_costs(pars, npv),
+        farm={
+            farm_type: FarmCosts(
+                land_rent=get_land_rent(pars, farm_type),
+                farm_annual=get_farm_cap_cost_annual(pars, farm_type, npv),
+                running_costs=get_running_costs(pars, farm_type),
+                revenue_per_ton=get_revenue(pars, farm_type),
+            )
+            for farm_type in ("cage", "pond")
+        },
+    )
+
+
+def model(town: Town, pars: Pars, prep: Optional[Prepared] = None) -> Result:
     """
     Main modelling entrypoint.
     Other functions in this file should not be called directly.
     """
+    prep = prep or prepare(pars)
 
     # Some decisions
     fish_output, farm_type = constrain_output(town, pars)  # ton/yr
 
     if farm_type != "none":
         # Costs
-        land_rent = get_land_rent(pars, farm_type)  # USD/ton/yr
-        npv = calc_npv(pars["duration"], pars["interest_rate"])
-        elec_cost_for_farm = get_elec_cost_for_farm(town, pars, npv)  # USD/ton/yr
-        farm_annual = get_farm_cap_cost_annual(pars, farm_type, npv)  # USD/ton/yr
-        equipment_annual = get_equipment_costs(pars, npv)  # USD/ton/yr
-        running_costs = get_running_costs(pars, farm_type)  # USD/ton/yr
+        costs = prep["farm"][farm_type]
+        land_rent = costs["land_rent"]  # USD/ton/yr
+        elec_cost_for_farm = get_elec_cost_for_farm(town, prep)  # USD/ton/yr
+        farm_annual = costs["farm_annual"]  # USD/ton/yr
+        equipment_annual = prep["equipment_annual"]  # USD/ton/yr
+        running_costs = costs["running_costs"]  # USD/ton/yr
         transport_costs = get_transport_costs(town)  # USD/ton/yr
         # Total costs
         costs_per_ton = (
@@ -370,7 +427,7 @@ def model(town: Town, pars: Pars) -> Result:
         )  # USD/ton/yr
 
         # Revenue
-        revenue_per_ton = get_revenue(pars, farm_type)  # USD/ton/yr
+        revenue_per_ton = costs["revenue_per_ton"]  # USD/ton/yr
 
         # Profit
         profit_per_ton = revenue_per_ton - costs_per_ton  # USD/ton/yr
@@ -409,3 +466,123 @@ def model(town: Town, pars: Pars) -> Result:
         gov_annual=0,
         social=0,
     )
+
+
+def constrain_output_batch(
+    towns: Columns, pars: Pars
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized `constrain_output` for columns of towns.
+
+    Returns:
+      fish_output in ton/yr
+      farm_type as an array of strings
+    """
+    cage = towns["lake_dist"] < pars["max_lake_dist"]
+    key_county = np.isin(np.char.lower(towns["adm1"]), C.key_counties)
+    pond = ~cage & (
+        (towns["water_dist"] < pars["max_water_dist"])
+        | (towns["river_dist"] < pars["max_water_dist"])
+        | (towns["precip"] > pars["min_precip"])
+        | key_county
+    )
+
+    feasible = (
+        (towns["precip"] > pars["min_precip"])
+        & (towns["pop"] > pars["min_pop"])
+        & (towns["pop"] < pars["max_pop"])
+    )
+    max_from_farm = np.select(
+        [cage, pond], [pars["max_fish_output"], towns["precip"] * 20], 0.0
+    )
+    labor = towns["hhs"] * pars["labor_per_hh"]  # number of laborers available
+    labor_needed = np.where(cage, 3, 1)  # worker/ton/yr
+    max_fish_from_labor = labor / labor_needed  # ton/yr
+    fish_output = np.where(
+        feasible,
+        np.minimum(
+            np.minimum(pars["max_fish_output"], max_fish_from_labor), max_from_farm
+        ),
+        0.0,
+    )  # ton/yr
+
+    farm_type = np.select(
+        [fish_output == 0, cage, pond], ["none", "cage", "pond"], "none"
+    )
+    fish_output = np.where(farm_type == "none", 0.0, fish_output)
+    return fish_output, farm_type
+
+
+def model_batch(
+    towns: Columns, pars: Pars, prep: Optional[Prepared] = None
+) -> Columns:
+    """
+    Columnar modelling entrypoint, giving the same results as `model`
+    for arrays of every `Town` field (one element per town).
+    """
+    prep = prep or prepare(pars)
+    towns = {
+        k: np.asarray(towns[k], dtype=str if k == "adm1" else "float64")
+        for k in Town.__annotations__
+    }
+    fish_output, farm_type = constrain_output_batch(towns, pars)
+    cage = farm_type == "cage"
+
+    def by_farm_type(key: str) -> np.ndarray:
+        return np.where(cage, prep["farm"]["cage"][key], prep["farm"]["pond"][key])
+
+    # Costs
+    land_rent = by_farm_type("land_rent")  # USD/ton/yr
+    elec_cost_for_farm = np.where(
+        towns["grid_dist"] < 20, 0, prep["mg_repayment"]
+    )  # USD/ton/yr
+    farm_annual = by_farm_type("farm_annual")  # USD/ton/yr
+    equipment_annual = prep["equipment_annual"]  # USD/ton/yr
+    running_costs = by_farm_type("running_costs")  # USD/ton/yr
+    transport_costs = get_transport_costs(towns)  # USD/ton/yr
+    costs_per_ton = (
+        land_rent
+        + elec_cost_for_farm
+        + running_costs
+        + farm_annual
+        + equipment_annual
+        + transport_costs
+    )  # USD/ton/yr
+
+    # Revenue and profit
+    revenue_per_ton = by_farm_type("revenue_per_ton")  # USD/ton/yr
+    profit_per_ton = revenue_per_ton - costs_per_ton  # USD/ton/yr
+    grid_cost = pars["grid_cost"] * towns["grid_dist"]  # USD/year
+    road_cost = pars["road_cost"] * towns["road_dist"]  # USD/year
+    infra_cost = grid_cost + road_cost  # USD/year
+    revenue = revenue_per_ton * fish_output  # USD/year
+    profit = profit_per_ton * fish_output - infra_cost  # USD/yr
+
+    # Gov costs
+    traffic = towns["pop"] / pars["traffic_pp"]  # vehicles/day
+    fish_vehicles = np.where(cage, 7.7, 10.2)  # num/ton of fish/yr
+    total_traffic = traffic + fish_vehicles * fish_output * pars["truck_econ_multi"]
+    road_maintenance_cost = np.select(
+        [total_traffic > 200 * 365, total_traffic > 50 * 365], [7_526, 5_822], 0
+    )  # USD/km/yr, for paved, gravel and earth roads
+    road_cap_cost = np.where(towns["road_dist"] < 10, 92_266.0 * 1.3, 92_266.0)
+    elec_capex = np.select(
+        [towns["grid_dist"] < 1, towns["grid_dist"] < 20],
+        [0, 15_000 * towns["grid_dist"] + 4800 * towns["hhs"]],
+        pars["mg_cost_pkw"] * (towns["hhs"] * 0.2) + 500 * towns["hhs"],
+    )  # USD
+    gov_costs = elec_capex + road_cap_cost * towns["road_dist"]  # USD
+    gov_annual = road_maintenance_cost * towns["road_dist"]  # USD/yr
+
+    social = get_social_benefit(towns)  # USD/yr
+
+    none = farm_type == "none"
+    return dict(
+        tech=farm_type,
+        fish_output=np.where(none, 0, np.maximum(0, fish_output)),
+        revenue=np.where(none, 0, np.maximum(0, revenue)),
+        profit=np.where(none, 0, np.maximum(0, profit)),
+        gov_costs=np.where(none, 0, np.maximum(0, gov_costs)),
+        gov_annual=np.where(none, 0, np.maximum(0, gov_annual)),
+        social=np.where(none, 0, np.maximum(0, social)),
+    )
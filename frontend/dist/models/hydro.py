@@ -1,4 +1,7 @@
-from typing import TypedDict
+from functools import lru_cache
+from typing import Optional, TypedDict
+
+import numpy as np
 
 
 class Town(TypedDict):
@@ -49,6 +52,18 @@ class C:
     ely_output_pressure: float = 30  # bar
 
 
+Columns = dict[str, np.ndarray]
+
+
+class Prepared(TypedDict):
+    pv_annual: float  # €/kWp*a
+    wind_annual: float  # €/kW*a
+    cost_ely: float
+    handling_energy: float  # kWh/kgh2 for compression or liquification
+    water_resource: str  # one of domestic, ocean, cheapest
+    turbine_area: float  # m2 per turbine
+
+
 class Result(TypedDict):
     tech: str
     elec_technology: str
@@ -81,24 +96,44 @@ def elec_tech(option1: float, option2: float) -> str:
         return "pv"
 
 
-def handling_costs(pars: Pars, cost_elec: float) -> float:
+def handling_energy(pars: Pars) -> float:
     """
-    Function handling costs (compression or liquification)
+    Energy for handling (compression or liquification) in kWh/kgh2
     """
     if "Liquid" in pars["h2_state"]:
-        return C.energy_liquid * (cost_elec / 1000)
+        return C.energy_liquid
     else:
         return float(
             (0.003944 * 298.15 * (((500 / C.ely_output_pressure) ** (0.4 / 1.4)) - 1))
             / 0.8
-        ) * (cost_elec / 1000)
+        )
 
 
-def water_costs(town: Town, pars: Pars, cost_elec: float) -> float:
+def handling_costs(prep: Prepared, cost_elec: float) -> float:
     """
-    Water costs
+    Function handling costs (compression or liquification)
+    """
+    return prep["handling_energy"] * (cost_elec / 1000)
+
+
+def water_resource(pars: Pars) -> str:
+    """
+    Which water resource to use: domestic, ocean or cheapest
     """
     if "Domestic" in pars["water_resource"]:
+        return "domestic"
+    elif "Ocean" in pars["water_resource"]:
+        return "ocean"
+    elif "Cheapest option" in pars["water_resource"]:
+        return "cheapest"
+    raise ValueError(f"Unknown water_resource: {pars['water_resource']}")
+
+
+def water_costs(town: Town, pars: Pars, prep: Prepared, cost_elec: float) -> float:
+    """
+    Water costs
+    """
+    if prep["water_resource"] == "domestic":
         return (
             (
                 C.water_spec_cost
@@ -108,7 +143,7 @@ def water_costs(town: Town, pars: Pars, cost_elec: float) -> float:
             * C.ely_water
             / 1000
         )
-    elif "Ocean" in pars["water_resource"]:
+    elif prep["water_resource"] == "ocean":
         return (
             (
                 C.water_spec_cost
@@ -118,7 +153,7 @@ def water_costs(town: Town, pars: Pars, cost_elec: float) -> float:
             * C.ely_water
             / 1000
         )
-    elif "Cheapest option" in pars["water_resource"]:
+    else:
         water_costs_h2_water_bodies = (
             (
                 C.water_spec_cost
@@ -152,20 +187,25 @@ def pv_kwp(pars: Pars, available_area: float) -> float:
         return 0
 
 
-def wind_pc(pars: Pars, available_area: float) -> float:
+def turbine_area(pars: Pars) -> float:
+    """
+    Area needed per wind turbine in m2
+    """
+    return (3.14 * ((pars["wind_dist"] * C.d_rot) ** 2)) / 4
+
+
+def wind_pc(pars: Pars, prep: Prepared, available_area: float) -> float:
     """
     Adding Wind GWh possible
     """
     if available_area > pars["min_area"]:
-        return ((available_area) * 1000000) / (
-            (3.14 * ((pars["wind_dist"] * C.d_rot) ** 2)) / 4
-        )
+        return ((available_area) * 1000000) / prep["turbine_area"]
     else:
         return 0
 
 
 def calc_turbine_output(town: Town) -> float:
-    return float(
+    return (
         0.5
         * C.cp
         * C.den_air
@@ -177,27 +217,26 @@ def calc_turbine_output(town: Town) -> float:
     )  # yearly power output per turbine
 
 
-def calc_cost_elec_wind(pars: Pars, turbine_output: float) -> float:
+def calc_wind_annual(pars: Pars) -> float:
     return (
-        (
-            (
-                pars["wind_capex"] / pvf(pars["interest_rate"] / 100, C.wind_lifetime)
-                + C.wind_opex
-            )
-        )
-        / turbine_output
-    ) * 1000
+        pars["wind_capex"] / pvf(pars["interest_rate"] / 100, C.wind_lifetime)
+        + C.wind_opex
+    )
 
 
-def calc_cost_elec_pv(town: Town, pars: Pars) -> float:
+def calc_pv_annual(pars: Pars) -> float:
     return (
-        (
-            pars["pv_capex"] / pvf((pars["interest_rate"] / 100), C.pv_lifetime)
-            + C.pv_opex
-        )
-        / town["pv"]
-        / 365
-    ) * 1000
+        pars["pv_capex"] / pvf((pars["interest_rate"] / 100), C.pv_lifetime)
+        + C.pv_opex
+    )
+
+
+def calc_cost_elec_wind(prep: Prepared, turbine_output: float) -> float:
+    return ((prep["wind_annual"]) / turbine_output) * 1000
+
+
+def calc_cost_elec_pv(town: Town, prep: Prepared) -> float:
+    return (prep["pv_annual"] / town["pv"] / 365) * 1000
 
 
 def calc_cost_ely(pars: Pars) -> float:
@@ -211,12 +250,12 @@ def calc_cost_ely(pars: Pars) -> float:
 
 
 def calc_cost_h2_ocean(
-    town: Town, pars: Pars, cost_ely: float, cost_elec: float, cost_elec_h2: float
+    town: Town, pars: Pars, prep: Prepared, cost_elec: float, cost_elec_h2: float
 ) -> float:
     return (
         cost_elec_h2
-        + cost_ely
-        + handling_costs(pars, cost_elec)
+        + prep["cost_ely"]
+        + handling_costs(prep, cost_elec)
         + (
             (
                 C.water_spec_cost
@@ -229,24 +268,47 @@ def calc_cost_h2_ocean(
     )
 
 
-def model(town: Town, pars: Pars) -> Result:
+def prepare(pars: Pars) -> Prepared:
+    """
+    Calculate everything that depends only on `pars`, once per parameter set
+    (the last few are remembered), to be passed on to `model`/`model_batch`.
+    """
+    return _prepare(tuple(pars.items()))
+
+
+@lru_cache(maxsize=16)
+def _prepare(items: tuple) -> Prepared:
+    pars: Pars = dict(items)  # type: ignore[assignment]
+    return Prepared(
+        pv_annual=calc_pv_annual(pars),
+        wind_annual=calc_wind_annual(pars),
+        cost_ely=calc_cost_ely(pars),
+        handling_energy=handling_energy(pars),
+        water_resource=water_resource(pars),
+        turbine_area=turbine_area(pars),
+    )
+
+
+def model(town: Town, pars: Pars, prep: Optional[Prepared] = None) -> Result:
+    prep = prep or prepare(pars)
+
     # Electricity cost calculation
-    cost_elec_pv = calc_cost_elec_pv(town, pars)
+    cost_elec_pv = calc_cost_elec_pv(town, prep)
     pv_radiation = town["pv"] * 365
     turbine_output = calc_turbine_output(town)
-    cost_elec_wind = calc_cost_elec_wind(pars, turbine_output)
+    cost_elec_wind = calc_cost_elec_wind(prep, turbine_output)
     cost_elec = min(cost_elec_pv, cost_elec_wind)
-    cost_ely = calc_cost_ely(pars)
+    cost_ely = prep["cost_ely"]
     elec_technology = elec_tech(cost_elec_pv, cost_elec_wind)
 
     # LCOH cost calculation
     cost_elec_h2 = (cost_elec / 1000) * (C.h2_en_den / C.ely_eff)
-    cost_h2_ocean = calc_cost_h2_ocean(town, pars, cost_ely, cost_elec, cost_elec_h2)
+    cost_h2_ocean = calc_cost_h2_ocean(town, pars, prep, cost_elec, cost_elec_h2)
     cost_h2 = (
         cost_elec_h2
         + cost_ely
-        + handling_costs(pars, cost_elec)
-        + water_costs(town, pars, cost_elec)
+        + handling_costs(prep, cost_elec)
+        + water_costs(town, pars, prep, cost_elec)
     )
 
     # Distance to port in mombasa --> demand center due to export
@@ -264,7 +326,7 @@ def model(town: Town, pars: Pars) -> Result:
     pv_kWp = pv_kwp(pars, available_area)
     pv_kWh = pv_kWp * town["pv"] / 1000000  # in GWh
 
-    wind_pcs = wind_pc(pars, available_area)
+    wind_pcs = wind_pc(pars, prep, available_area)
     wind_kWh = turbine_output * wind_pcs / 1000000  # in GWh
 
     return Result(
@@ -281,3 +343,99 @@ def model(town: Town, pars: Pars) -> Result:
         pv_kWh=pv_kWh,
         wind_kWh=wind_kWh,
     )
+
+
+def water_costs_batch(
+    towns: Columns, pars: Pars, prep: Prepared, cost_elec: np.ndarray
+) -> np.ndarray:
+    """
+    Vectorized `water_costs` for columns of towns.
+    """
+    water_costs_h2_water_bodies = (
+        (
+            C.water_spec_cost
+            + (pars["water_tran_cost"] / 100) * towns["water_dist"]
+            + pars["elec_water_treatment"] * cost_elec
+        )
+        * C.ely_water
+        / 1000
+    )
+    water_costs_h2_ocean = (
+        (
+            C.water_spec_cost
+            + (pars["water_tran_cost"] / 100) * towns["ocean_dist"]
+            + pars["elec_ocean_water_treatment"] * cost_elec
+        )
+        * C.ely_water
+        / 1000
+    )
+    if prep["water_resource"] == "domestic":
+        return water_costs_h2_water_bodies
+    elif prep["water_resource"] == "ocean":
+        return water_costs_h2_ocean
+    return np.where(
+        water_costs_h2_ocean > water_costs_h2_water_bodies,
+        water_costs_h2_water_bodies,
+        water_costs_h2_ocean,
+    )
+
+
+def model_batch(
+    towns: Columns, pars: Pars, prep: Optional[Prepared] = None
+) -> Columns:
+    """
+    Columnar modelling entrypoint, giving the same results as `model`
+    for arrays of every `Town` field (one element per town).
+    """
+    prep = prep or prepare(pars)
+    towns = {k: np.asarray(towns[k], dtype="float64") for k in Town.__annotations__}
+
+    # Electricity cost calculation
+    cost_elec_pv = calc_cost_elec_pv(towns, prep)
+    pv_radiation = towns["pv"] * 365
+    turbine_output = calc_turbine_output(towns)
+    cost_elec_wind = calc_cost_elec_wind(prep, turbine_output)
+    cost_elec = np.minimum(cost_elec_pv, cost_elec_wind)
+    cost_ely = prep["cost_ely"]
+    elec_technology = np.where(cost_elec_pv > cost_elec_wind, "wind", "pv")
+
+    # LCOH cost calculation
+    cost_elec_h2 = (cost_elec / 1000) * (C.h2_en_den / C.ely_eff)
+    cost_h2_ocean = calc_cost_h2_ocean(towns, pars, prep, cost_elec, cost_elec_h2)
+    cost_h2 = (
+        cost_elec_h2
+        + cost_ely
+        + handling_costs(prep, cost_elec)
+        + water_costs_batch(towns, pars, prep, cost_elec)
+    )
+    h2_cost_to_demand = cost_h2 + (pars["h2_trans_cost"] * towns["mombasa_dist"] / 100)
+
+    # Including restricted surface area: Currently forest, agri and water
+    available_area = towns["avail_area"] - towns["rest_area"]
+    usable = available_area > pars["min_area"]
+    tech = np.where(usable, "something", "none")
+
+    pv_kWp = np.where(usable, ((available_area) * 1000000) / pars["pv_size"], 0)
+    pv_kWh = pv_kWp * towns["pv"] / 1000000  # in GWh
+
+    wind_pcs = np.where(
+        usable,
+        ((available_area) * 1000000) / prep["turbine_area"],
+        0,
+    )
+    wind_kWh = turbine_output * wind_pcs / 1000000  # in GWh
+
+    return dict(
+        elec_technology=elec_technology,
+        tech=tech,
+        cost_elec_pv=cost_elec_pv,
+        cost_elec_wind=cost_elec_wind,
+        cost_elec=cost_elec,
+        cost_h2=cost_h2,
+        cost_h2_ocean=cost_h2_ocean,
+        turbine_output=turbine_output,
+        pv_radiation=pv_radiation,
+        h2_cost_to_demand=h2_cost_to_demand,
+        pv_kWh=pv_kWh,
+        wind_kWh=wind_kWh,
+    )
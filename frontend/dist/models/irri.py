@@ -1,4 +1,7 @@
-from typing import TypedDict
+from functools import lru_cache
+from typing import Optional, TypedDict
+
+import numpy as np
 
 
 class Town(TypedDict):
@@ -24,6 +27,13 @@ class C:
     kWh_cost: float = 0.8
 
 
+Columns = dict[str, np.ndarray]
+
+
+class Prepared(TypedDict):
+    production_multi: float
+
+
 class Result(TypedDict):
     tech: str
     crop_production: float
@@ -42,8 +52,28 @@ def getProductionMultiplier(pars: Pars) -> float:
         return 0.7
 
 
-def model(town: Town, pars: Pars) -> Result:
-    productionMulti = getProductionMultiplier(pars)
+def prepare(pars: Pars) -> Prepared:
+    """
+    Calculate everything that depends only on `pars`, once per parameter set
+    (the last few are remembered), to be passed on to `model`/`model_batch`.
+    """
+    return _prepare(tuple(pars.items()))
+
+
+@lru_cache(maxsize=16)
+def _prepare(items: tuple) -> Prepared:
+    pars: Pars = dict(items)  # type: ignore[assignment]
+    return Prepared(production_multi=getProductionMultiplier(pars))
+
+
+def calc_production(
+    town: Town, pars: Pars, prep: Prepared
+) -> tuple[float, float, float, float, float]:
+    """
+    Returns:
+      crop_production, transp_cost, irrig_cost, revenue, profit
+    """
+    productionMulti = prep["production_multi"]
     crop_production = (
         ((town["crop_extentmajority"] * 0.5) / 100)
         * C.h3size
@@ -74,7 +104,14 @@ def model(town: Town, pars: Pars) -> Result:
 
     revenue = crop_production * pars["crop_price"]
     profit = revenue - transp_cost - irrig_cost
+    return crop_production, transp_cost, irrig_cost, revenue, profit
+
 
+def model(town: Town, pars: Pars, prep: Optional[Prepared] = None) -> Result:
+    prep = prep or prepare(pars)
+    crop_production, transp_cost, irrig_cost, revenue, profit = calc_production(
+        town, pars, prep
+    )
     tech = "agri" if crop_production > 0.5 else "none"
 
     return dict(
@@ -85,3 +122,26 @@ def model(town: Town, pars: Pars) -> Result:
         profit=max(0, profit),
         tech=tech,
     )
+
+
+def model_batch(
+    towns: Columns, pars: Pars, prep: Optional[Prepared] = None
+) -> Columns:
+    """
+    Columnar modelling entrypoint, giving the same results as `model`
+    for arrays of every `Town` field (one element per town).
+    """
+    prep = prep or prepare(pars)
+    towns = {k: np.asarray(towns[k], dtype="float64") for k in Town.__annotations__}
+    # plain arithmetic, so it works on arrays too
+    crop_production, transp_cost, irrig_cost, revenue, profit = calc_production(
+        towns, pars, prep  # type: ignore[arg-type]
+    )
+    return dict(
+        crop_production=np.maximum(0, crop_production),
+        transp_cost=np.maximum(0, transp_cost),
+        irrig_cost=np.maximum(0, irrig_cost),
+        revenue=np.maximum(0, revenue),
+        profit=np.maximum(0, profit),
+        tech=np.where(crop_production > 0.5, "agri", "none"),
+    )
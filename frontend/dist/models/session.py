@@ -0,0 +1,89 @@
+from typing import Any, Callable
+
+import numpy as np
+from propagate import build_adjacency, propagate
+
+Columns = dict[str, np.ndarray]
+ModelBatch = Callable[[Columns, Any], Columns]
+
+
+class ModelSession:
+    """
+    Keeps a model's input columns and its last results for every hexagon,
+    so that only the hexagons whose inputs have changed (eg `grid_dist` after
+    drawing a line) are run through the model again.
+    If the parameters change, every hexagon is run again.
+    """
+
+    def __init__(self, model_batch: ModelBatch, towns: dict[str, list]) -> None:
+        self.model_batch = model_batch
+        self.towns: Columns = {k: column(v) for k, v in towns.items()}
+        self.n = len(next(iter(self.towns.values()), []))
+        self.dirty = np.ones(self.n, dtype=bool)
+        self.results: Columns = {}
+        self.pars: Any = None
+        self.adjacency: Any = None
+
+    def set_rows(self, col: str, rows: list[int], values: list) -> None:
+        """
+        Update the values of a column for some rows,
+        marking the rows whose values have actually changed.
+        """
+        idx = np.asarray(rows, dtype="int64")
+        vals = np.asarray(values, dtype=self.towns[col].dtype)
+        changed = self.towns[col][idx] != vals
+        self.towns[col][idx[changed]] = vals[changed]
+        self.dirty[idx[changed]] = True
+
+    def draw(self, col: str, rows: list[int], step: float) -> dict[str, list]:
+        """
+        Set a column to 0 for the rows under a drawing and spread it outwards
+        over the neighbor graph (see `propagate`), marking the changed rows.
+
+        Returns: the changed "rows" and their new "values"
+        """
+        if self.adjacency is None:
+            neighbors = np.column_stack([self.towns[f"n{i}"] for i in range(6)])
+            self.adjacency = build_adjacency(neighbors, self.towns.get("index"))
+        values = self.towns[col].astype("float64")
+        idx = np.asarray(rows, dtype="int64")
+        changed = propagate(values, idx, *self.adjacency, step)
+        self.towns[col] = values
+        self.dirty[changed] = True
+        return {"rows": changed.tolist(), "values": values[changed].tolist()}
+
+    def run(self, pars: Any) -> np.ndarray:
+        """
+        Run the model on the rows that have changed since the last run,
+        or on every row if `pars` have changed.
+
+        Returns: the rows that were run
+        """
+        if pars != self.pars or not self.results:
+            self.dirty[:] = True
+        rows = np.flatnonzero(self.dirty)
+        if len(rows) == self.n and self.n > 0:
+            res = self.model_batch(self.towns, pars)
+            self.results = {k: column(v) for k, v in res.items()}
+        elif len(rows) > 0:
+            res = self.model_batch({k: v[rows] for k, v in self.towns.items()}, pars)
+            for k, v in res.items():
+                self.results[k][rows] = v
+        self.dirty[:] = False
+        self.pars = dict(pars)
+        return rows
+
+    def get_rows(self, rows: np.ndarray) -> dict[str, list]:
+        """
+        Returns: the latest results for `rows`, as a list per column
+        """
+        return {k: v[rows].tolist() for k, v in self.results.items()}
+
+
+def column(values: Any) -> np.ndarray:
+    """
+    Convert values to an array that can be updated in place
+    (strings are kept as objects so longer ones aren't truncated).
+    """
+    arr = np.asarray(values)
+    return arr.astype(object) if arr.dtype.kind == "U" else arr.copy()
@@ -0,0 +1,128 @@
+"""
+Warp raster features onto one common grid before their zonal statistics,
+so every aligned raster shares a single hex-pixel index.
+
+Each raster is warped once (with GDAL, through rasterio's WarpedVRT) and saved
+as a tiled, compressed Cloud Optimized GeoTIFF in the cache, keyed by the
+contents of the source raster, the grid and the resampling.
+"""
+
+import math
+from pathlib import Path
+from typing import Optional, Union
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from typer import echo
+
+from spider import report
+from spider.cache import cache_path, file_hash, hash_key, tmp_path
+
+# How pixels are combined for each operation
+# ('count' counts source pixels, so it isn't aligned)
+resampling = {
+    "sum": Resampling.sum,
+    "mean": Resampling.average,
+    "max": Resampling.max,
+    "min": Resampling.min,
+}
+
+
+def get_grid(
+    spec: Union[bool, str, dict], raster_like: Path, geom: gpd.GeoDataFrame
+) -> dict:
+    """
+    Get the grid to align rasters to from the `align` config.
+
+    Parameters
+    ----------
+    spec: bool, str or dict
+        True or 'raster_like' to use the `raster_like` grid, or a dict with
+        `crs` and `resolution` (in CRS units) for a grid covering the hexagons.
+    raster_like: pathlib.Path
+    geom: geopandas.GeoDataFrame
+        The hexagons.
+
+    Returns: dict with the grid's crs, transform, width and height
+    """
+    if spec is True or spec == "raster_like":
+        with rasterio.open(raster_like) as rd:
+            return dict(
+                crs=rd.crs, transform=rd.transform, width=rd.width, height=rd.height
+            )
+
+    if not isinstance(spec, dict) or not {"crs", "resolution"} <= set(spec):
+        raise ValueError("align must be 'raster_like' or have 'crs' and 'resolution'")
+    crs = CRS.from_user_input(spec["crs"])
+    res = float(spec["resolution"])
+    minx, miny, maxx, maxy = geom.to_crs(crs).total_bounds
+    # snapped to whole pixels, so the same hexagons always give the same grid
+    minx, miny = math.floor(minx / res) * res, math.floor(miny / res) * res
+    maxx, maxy = math.ceil(maxx / res) * res, math.ceil(maxy / res) * res
+    return dict(
+        crs=crs,
+        transform=from_origin(minx, maxy, res, res),
+        width=max(1, round((maxx - minx) / res)),
+        height=max(1, round((maxy - miny) / res)),
+    )
+
+
+def grid_key(grid: dict) -> tuple:
+    return (
+        grid["crs"].to_wkt(),
+        tuple(grid["transform"]),
+        (grid["width"], grid["height"]),
+    )
+
+
+def align_raster(
+    raster: Path, operation: str, grid: dict, cache_dir: Optional[Path]
+) -> Path:
+    """
+    Warp a raster onto the grid, or get it from the cache if it's been done.
+
+    Returns: the path of the aligned raster
+    """
+    if cache_dir is None:
+        raise ValueError("Aligning rasters needs a cache_dir")
+    method = resampling[operation]
+    key = hash_key("aligned", file_hash(raster), grid_key(grid), method.name)
+    path = cache_path(cache_dir, "aligned", key, ".tif")
+    if path.exists():
+        return path
+
+    echo(f"Aligning {raster.name} ({method.name})")
+    with report.stage("align"):
+        with rasterio.open(raster) as src:
+            # pixels outside the source must be nodata, not 0
+            dtype, nodata = src.dtypes[0], src.nodata
+            if nodata is None:
+                dtype = np.promote_types(dtype, "float32").name
+                nodata = float("nan")
+            with WarpedVRT(
+                src,
+                crs=grid["crs"],
+                transform=grid["transform"],
+                width=grid["width"],
+                height=grid["height"],
+                resampling=method,
+                dtype=dtype,
+                nodata=nodata,
+            ) as vrt:
+                tmp = tmp_path(path)
+                rasterio.shutil.copy(
+                    vrt,
+                    tmp,
+                    driver="COG",
+                    compress="deflate",
+                    blocksize=512,
+                    overview_resampling="average",
+                )
+        tmp.replace(path)
+    return path
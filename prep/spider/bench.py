@@ -0,0 +1,304 @@
+"""
+Benchmarks for the prep stages and the app models, for comparing runs with
+`spi bench`. The prep stages use synthetic inputs made on the fly, so they
+don't need any downloads.
+
+Each stage runs in a fresh process, so its peak memory isn't hidden by
+whatever ran before it.
+"""
+
+import csv
+import json
+import platform
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from importlib.metadata import PackageNotFoundError, version
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Optional
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import rasterio
+import shapely
+from affine import Affine
+from rasterio.transform import from_origin
+from typer import echo
+
+from spider.features import add_raster_layer, add_vector_layer, create_hex
+from spider.neighbors import add_neighbors
+from spider.report import peak_rss
+from spider.run import get_pars, load_app_config, load_model
+
+prep_stages = ("create_hex", "add_neighbors", "raster_mean", "lines", "points")
+center = (37.7, 0.3)
+
+
+def make_inputs(folder: Path, size: float = 1.0, seed: int = 0) -> dict:
+    """
+    Make a synthetic AOI, raster, `raster_like` and line and point vectors.
+
+    Parameters
+    ----------
+    folder: pathlib.Path
+        Directory to save them in.
+    size: float, optional (default 1.0)
+        Width of the AOI in degrees (about 110 km).
+    seed: int, optional (default 0)
+
+    Returns: dict of paths
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = {
+        k: folder / f"{k}{ext}"
+        for k, ext in [
+            ("aoi", ".geojson"),
+            ("raster", ".tif"),
+            ("raster_like", ".tif"),
+            ("lines", ".geojson"),
+            ("points", ".geojson"),
+        ]
+    }
+
+    # a ragged blob rather than a box, so the AOI edges are like real ones
+    angles = np.linspace(0, 2 * np.pi, 60, endpoint=False)
+    radius = size / 2 * rng.uniform(0.7, 1.0, len(angles))
+    aoi = shapely.Polygon(
+        np.column_stack(
+            [center[0] + radius * np.cos(angles), center[1] + radius * np.sin(angles)]
+        )
+    )
+    gpd.GeoDataFrame(geometry=[aoi], crs=4326).to_file(paths["aoi"])
+
+    minx, miny, maxx, maxy = aoi.buffer(0.05).bounds
+    pixel = 0.002
+    shape = (int((maxy - miny) / pixel), int((maxx - minx) / pixel))
+    write_raster(
+        paths["raster"],
+        rng.gamma(2, 50, shape).astype("float32"),
+        from_origin(minx, maxy, pixel, pixel),
+        "EPSG:4326",
+    )
+
+    bounds = gpd.GeoSeries([aoi.buffer(0.05)], crs=4326).to_crs(4088).total_bounds
+    pixel = 250
+    shape = (
+        int((bounds[3] - bounds[1]) / pixel),
+        int((bounds[2] - bounds[0]) / pixel),
+    )
+    write_raster(
+        paths["raster_like"],
+        np.ones(shape, dtype="uint8"),
+        from_origin(bounds[0], bounds[3], pixel, pixel),
+        "EPSG:4088",
+    )
+
+    def random_points(n: int) -> np.ndarray:
+        return rng.uniform((minx, miny), (maxx, maxy), (n, 2))
+
+    lines = [shapely.LineString(random_points(5)) for _ in range(20)]
+    gpd.GeoDataFrame(geometry=lines, crs=4326).to_file(paths["lines"])
+    points = shapely.points(random_points(200))
+    gpd.GeoDataFrame(geometry=points, crs=4326).to_file(paths["points"])
+    return paths
+
+
+def write_raster(path: Path, arr: np.ndarray, transform: Affine, crs: str) -> None:
+    profile = dict(
+        driver="GTiff",
+        height=arr.shape[0],
+        width=arr.shape[1],
+        count=1,
+        dtype=arr.dtype,
+        crs=crs,
+        transform=transform,
+    )
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(arr, 1)
+
+
+def measure(stage: str, paths: dict, res: Optional[int], repeat: int) -> dict:
+    """
+    Run a stage `repeat` times, after loading its inputs, and time it.
+    This is run in a fresh process for each stage.
+    """
+    run, n = setup(stage, paths, res)
+    before = peak_rss()
+    walls, cpus = [], []
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        out = run()
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+    if stage == "create_hex":
+        # saved for the other stages to use
+        out.to_pickle(paths["folder"] / f"hex_{res}.pkl")
+        n = len(out)
+    peak = peak_rss()
+    return {
+        "stage": stage,
+        "resolution": res,
+        "hexagons": n,
+        "wall_s": min(walls),
+        "wall_median_s": float(np.median(walls)),
+        "cpu_s": min(cpus),
+        "hexagons_per_s": n / min(walls) if min(walls) > 0 else None,
+        "peak_rss_mb": peak,
+        "rss_added_mb": None if peak is None else peak - before,
+    }
+
+
+def setup(stage: str, paths: dict, res: Optional[int]) -> tuple:
+    """
+    Load the inputs for a stage.
+
+    Returns: a function that runs it, and the number of hexagons
+    """
+    if stage == "create_hex":
+        aoi = gpd.read_file(paths["aoi"])
+        return (lambda: create_hex(aoi, res)), None
+
+    if stage.startswith("model_"):
+        _, name, kind = stage.split("_")
+        cfg, app_dir = load_app_config(paths["configs"] / f"{name}.yml")
+        model = load_model(app_dir / cfg["model"])
+        df = gpd.read_file(app_dir / cfg["data"], ignore_geometry=True)
+        pars = get_pars(cfg)
+        if kind == "batch":
+            towns = {k: df[k].to_numpy() for k in df.columns}
+            return (lambda: model.model_batch(towns, pars)), len(df)
+        towns = df.to_dict("records")
+        return (lambda: [model.model(t, pars) for t in towns]), len(df)
+
+    geom = pd.read_pickle(paths["folder"] / f"hex_{res}.pkl")
+    runs = {
+        "add_neighbors": lambda: add_neighbors(geom),
+        "raster_mean": lambda: add_raster_layer(geom, paths["raster"], "mean"),
+        "lines": lambda: add_vector_layer(
+            geom, paths["lines"], "distance", paths["raster_like"]
+        ),
+        "points": lambda: add_vector_layer(
+            geom, paths["points"], "distance", paths["raster_like"], method="vector"
+        ),
+    }
+    return runs[stage], len(geom)
+
+
+def run_bench(
+    folder: Path,
+    resolutions: list,
+    configs: Path,
+    models: list,
+    repeat: int = 3,
+    size: float = 1.0,
+) -> dict:
+    """
+    Run the prep stages at each H3 resolution, and the scalar (`model`) and
+    batch (`model_batch`) versions of each app model on its hex data.
+
+    Parameters
+    ----------
+    folder: pathlib.Path
+        Directory for the synthetic inputs.
+    resolutions: list of int
+    configs: pathlib.Path
+        Directory with the app configs (frontend/dist/config).
+    models: list of str
+        Apps to run the models for (eg fish, hydro).
+    repeat: int, optional (default 3)
+        Number of times to run each stage (the fastest is reported).
+    size: float, optional (default 1.0)
+        Width of the synthetic AOI in degrees.
+
+    Returns: the report, with the environment and a list of results
+    """
+    paths = {**make_inputs(folder, size), "folder": Path(folder), "configs": configs}
+    jobs = [(s, r) for r in resolutions for s in prep_stages]
+    skipped = []
+    for name in models:
+        cfg, app_dir = load_app_config(Path(configs) / f"{name}.yml")
+        if not (app_dir / cfg["data"]).exists():
+            skipped.append({"stage": f"model_{name}", "reason": "no hex data"})
+            continue
+        jobs += [(f"model_{name}_scalar", None), (f"model_{name}_batch", None)]
+
+    results = []
+    for stage, res in jobs:
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(measure, stage, paths, res, repeat).result()
+        echo(
+            f"{label(result)}: {result['wall_s']:.3f}s, "
+            f"{result['hexagons']:,} hexagons, peak {result['peak_rss_mb'] or 0:.0f} MB"
+        )
+        results.append(result)
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "options": {"resolutions": resolutions, "repeat": repeat, "size": size},
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def environment() -> dict:
+    packages = ["numpy", "pandas", "geopandas", "shapely", "h3", "rasterio", "scipy"]
+    versions = {}
+    for p in packages:
+        try:
+            versions[p] = version(p)
+        except PackageNotFoundError:
+            versions[p] = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "packages": versions,
+    }
+
+
+def compare(report: dict, baseline: dict) -> list:
+    """
+    Compare two reports' times.
+
+    Returns: lines with each stage's time in both, and the ratio
+    """
+    old = {(r["stage"], r["resolution"]): r for r in baseline["results"]}
+    lines = []
+    for r in report["results"]:
+        b = old.get((r["stage"], r["resolution"]))
+        if b is None:
+            continue
+        ratio = r["wall_s"] / b["wall_s"] if b["wall_s"] else float("nan")
+        lines.append(
+            f"{label(r)}: {b['wall_s']:.3f}s -> {r['wall_s']:.3f}s ({ratio:.2f}x)"
+        )
+    return lines
+
+
+def label(result: dict) -> str:
+    if result["resolution"] is None:
+        return result["stage"]
+    return f"{result['stage']} (res {result['resolution']})"
+
+
+def save_report(report: dict, out: Path) -> None:
+    """
+    Save a report as JSON, or as CSV with a row per result
+    (without the environment, so it can't be used as a `--baseline`).
+    """
+    out = Path(out)
+    if out.suffix == ".csv":
+        rows = report["results"]
+        fields = list(dict.fromkeys(k for row in rows for k in row))
+        with out.open("w", newline="") as f:
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        return
+    with out.open("w") as f:
+        json.dump(report, f, indent=2)
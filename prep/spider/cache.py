@@ -0,0 +1,149 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+
+def hash_key(*parts: object) -> str:
+    """
+    Create a short hex digest from any number of parts.
+
+    Each part is converted with `repr`, so only pass values with a stable repr
+    (strings, numbers, tuples of those, bytes).
+    """
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else repr(p).encode())
+        h.update(b"\0")
+    return h.hexdigest()[:24]
+
+
+def hex_key(geom: gpd.GeoDataFrame) -> str:
+    """
+    Identify a hex geometry by its H3 cells (or its geometries if there aren't any).
+    """
+    if "h3_index" in geom.columns:
+        return hash_key("\n".join(geom["h3_index"].astype(str)))
+    return hash_key(b"".join(geom.geometry.to_wkb()))
+
+
+def cache_path(cache_dir: Path, kind: str, key: str, suffix: str) -> Path:
+    """
+    Get the path for a cache entry, creating its parent directory if needed.
+    """
+    path = Path(cache_dir) / kind / f"{key}{suffix}"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def tmp_path(path: Path) -> Path:
+    """
+    Get a temporary path next to a cache entry to write it to before moving it
+    into place, so other processes never see a half-written entry.
+    """
+    return path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+
+_file_hashes = {}
+
+
+def file_hash(path: Path) -> str:
+    """
+    Hash the contents of a file.
+    For shapefiles, the sidecar files (.dbf, .shx, .prj etc) are included.
+    Hashes are remembered (for as long as the file is unchanged) within a run.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    memo = (path, stat.st_size, stat.st_mtime_ns)
+    if memo not in _file_hashes:
+        _file_hashes[memo] = _file_hash(path)
+    return _file_hashes[memo]
+
+
+def _file_hash(path: Path) -> str:
+    files = [path]
+    if path.suffix.lower() == ".shp":
+        files = sorted(p for p in path.parent.glob(f"{path.stem}.*") if p.is_file())
+    h = hashlib.sha256()
+    for p in files:
+        h.update(p.suffix.encode())
+        with p.open("rb") as f:
+            for chunk in iter(lambda: f.read(2**20), b""):
+                h.update(chunk)
+    return h.hexdigest()[:24]
+
+
+def save_array(path: Path, arr: np.ndarray) -> None:
+    """
+    Save an array as .npy.
+    """
+    tmp = tmp_path(path)
+    with tmp.open("wb") as f:
+        np.save(f, arr)
+    tmp.replace(path)
+
+
+def load_array(path: Path) -> np.ndarray:
+    """
+    Memory-map a cached array, marking it as recently used.
+    """
+    path.touch()
+    return np.load(path, mmap_mode="r")
+
+
+def evict(cache_dir: Path, kind: str, max_bytes: int) -> None:
+    """
+    Delete the least recently used entries of a kind of cache entry
+    until they take up at most `max_bytes`.
+    """
+    entries = [
+        p
+        for p in (Path(cache_dir) / kind).glob("*")
+        if p.is_file() and not p.name.startswith(".")
+    ]
+    entries.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    total = 0
+    for p in entries:
+        total += p.stat().st_size
+        if total > max_bytes:
+            p.unlink()
+
+
+def save_column(path: Path, col: pd.Series, key: str) -> None:
+    """
+    Save a column of values (numbers or strings) as .npz, along with the key
+    it was calculated for.
+    """
+    mask = col.isna().to_numpy()
+    values = col.to_numpy()
+    if values.dtype == object:
+        values = np.where(mask, "", values.astype(str)).astype(str)
+    tmp = tmp_path(path)
+    with tmp.open("wb") as f:
+        np.savez(f, values=values, mask=mask, key=np.array(key))
+    tmp.replace(path)
+
+
+def load_column(path: Path, key: str) -> Optional[np.ndarray]:
+    """
+    Load a column saved with `save_column`,
+    or None if there isn't one or it was saved for a different key.
+    """
+    if not path.exists():
+        return None
+    with np.load(path) as f:
+        if str(f["key"]) != key:
+            return None
+        values, mask = f["values"], f["mask"]
+    if values.dtype.kind == "U":
+        values = values.astype(object)
+        values[mask] = None
+    elif mask.any():
+        values = values.astype("float64")
+        values[mask] = np.nan
+    return values
@@ -0,0 +1,45 @@
+import geopandas as gpd
+import numpy as np
+from typer import echo
+
+from spider.propagate import build_adjacency, propagate
+
+
+def apply_lines(
+    geom: gpd.GeoDataFrame, lines: gpd.GeoDataFrame, hex_size: float
+) -> gpd.GeoDataFrame:
+    """
+    Apply infrastructure drawn in the web app to a hex geometry.
+
+    Lines are as saved by the app's download button: each one has a `type`
+    property with the column it affects (eg `grid_dist`). Hexagons under the
+    lines are set to 0, and this is spread outwards, adding `hex_size` for
+    each ring of hexagons, wherever it lowers the existing value.
+
+    Parameters
+    ----------
+    geom: geopandas.GeoDataFrame
+        Hex geometry with n0..n5 columns (from `add_neighbors`).
+    lines: geopandas.GeoDataFrame
+        The drawn lines (or points).
+    hex_size: float
+        Amount to add for each ring of hexagons (the app's `hexSize`).
+    """
+    if "type" not in lines.columns:
+        raise ValueError("Lines need a 'type' property with the column to change")
+
+    neighbors = geom[[f"n{i}" for i in range(6)]].to_numpy()
+    labels = geom["index"] if "index" in geom.columns else geom.index
+    indptr, indices = build_adjacency(neighbors, labels.to_numpy())
+
+    geom = geom.copy()
+    lines = lines.to_crs(geom.crs)
+    for col, group in lines.groupby("type"):
+        if col not in geom.columns:
+            raise ValueError(f"Hex geometry has no '{col}' column")
+        _, hits = geom.sindex.query(group.geometry.values, predicate="intersects")
+        values = geom[col].to_numpy(dtype="float64", copy=True)
+        changed = propagate(values, np.unique(hits), indptr, indices, hex_size)
+        geom[col] = values
+        echo(f"Drawn {col} changed {len(changed)} hexagons")
+    return geom
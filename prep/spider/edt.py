@@ -0,0 +1,149 @@
+import math
+from typing import Optional
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from affine import Affine
+from rasterio.features import rasterize
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+from scipy import ndimage
+from typer import echo
+
+# Rough peak bytes per pixel of ndimage.distance_transform_edt on a 2D grid:
+# the input, the int32 feature indices it uses internally and the float64 output
+bytes_per_pixel = 32
+
+# Smallest tile core worth processing
+min_tile = 64
+
+
+def tiled_distance(
+    vector: gpd.GeoDataFrame,
+    affine: Affine,
+    shape: tuple,
+    out: np.ndarray,
+    memory: float = 1024,
+    max_distance: Optional[float] = None,
+    **options: object,
+) -> np.ndarray:
+    """
+    Calculate every pixel's distance to a vector, one tile at a time.
+
+    Each tile is rasterized and distance transformed together with a halo of
+    `max_distance` around it, so the result is exact for all distances up to
+    `max_distance`, and larger distances are clipped to `max_distance`.
+
+    If `max_distance` isn't given, or the halo it needs doesn't fit in `memory`,
+    the halo is made as large as `memory` allows and pixels further than that
+    from the vector are filled in from a distance transform on a grid that is
+    coarser by a factor k. That is accurate to within sqrt(2) * (k - 1) pixels.
+
+    Parameters
+    ----------
+    vector: geopandas.GeoDataFrame
+        Features to calculate distances to, in the grid's CRS.
+    affine: affine.Affine
+        The grid's transform (pixels must be square).
+    shape: tuple
+        The grid's (height, width).
+    out: numpy.ndarray
+        Array of `shape` to write the distances into, eg a numpy.memmap.
+    memory: float, optional (default 1024)
+        Peak memory to aim for, in MB.
+    max_distance: float, optional
+        Largest distance (in CRS units) that needs to be exact.
+    options:
+        Passed on to rasterio.features.rasterize.
+    """
+    height, width = shape
+    px = abs(affine[0])
+    budget = int(memory * 2**20)
+    side = int(math.sqrt(budget / bytes_per_pixel))
+
+    halo = math.ceil(max_distance / px) if max_distance is not None else None
+    exact = halo is not None and side - 2 * halo >= min_tile
+    if exact:
+        tile = side - 2 * halo
+    else:
+        # split the memory between the tiles and the coarse grid
+        side = int(math.sqrt(budget / 2 / bytes_per_pixel))
+        halo = min(halo or side, max(1, side // 4))
+        tile = max(min_tile, side - 2 * halo)
+
+    coarse = None
+    if not exact:
+        k = math.ceil(math.sqrt(height * width * bytes_per_pixel * 2 / budget))
+        k = max(1, k)
+        coarse = coarse_distance(vector, affine, shape, k, **options)
+        echo(
+            f"Distances beyond {halo * px:.0f} are accurate "
+            f"to within {math.sqrt(2) * (k - 1) * px:.0f}"
+        )
+
+    sindex = vector.sindex
+    shapes = vector.geometry.values
+    for row in range(0, height, tile):
+        for col in range(0, width, tile):
+            core = Window(col, row, min(tile, width - col), min(tile, height - row))
+            win = Window(
+                max(0, col - halo),
+                max(0, row - halo),
+                min(width, col + core.width + halo) - max(0, col - halo),
+                min(height, row + core.height + halo) - max(0, row - halo),
+            )
+            win_transform = window_transform(win, affine)
+            x0, y0 = win_transform * (0, 0)
+            x1, y1 = win_transform * (win.width, win.height)
+            idx = sindex.query(
+                shapely.box(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+            )
+
+            r0, c0 = core.row_off - win.row_off, core.col_off - win.col_off
+            inner = (
+                slice(r0, r0 + core.height),
+                slice(c0, c0 + core.width),
+            )
+            dist = np.full((core.height, core.width), np.inf)
+            if len(idx) > 0:
+                grid_raster = rasterize(
+                    shapes[idx],
+                    out_shape=(win.height, win.width),
+                    transform=win_transform,
+                    **options,
+                )
+                if not grid_raster.all():
+                    dist = ndimage.distance_transform_edt(grid_raster)[inner] * px
+
+            if exact:
+                dist = np.minimum(dist, max_distance)
+            # anything further than the halo could be closer to something outside it
+            elif (far := dist > halo * px).any():
+                rows = (np.arange(core.height) + core.row_off) // k
+                cols = (np.arange(core.width) + core.col_off) // k
+                approx = np.maximum(coarse[np.ix_(rows, cols)], halo * px)
+                dist = np.where(far, approx, dist)
+
+            out[core.toslices()] = dist
+    return out
+
+
+def coarse_distance(
+    vector: gpd.GeoDataFrame, affine: Affine, shape: tuple, k: int, **options: object
+) -> np.ndarray:
+    """
+    Calculate distances on a grid coarser by a factor of `k`,
+    where a coarse pixel counts as a feature if any of its pixels would.
+    """
+    height, width = shape
+    coarse_shape = (math.ceil(height / k), math.ceil(width / k))
+    grid_raster = rasterize(
+        vector.geometry.values,
+        out_shape=coarse_shape,
+        transform=affine * Affine.scale(k),
+        **{**options, "all_touched": True},
+    )
+    if grid_raster.all():
+        return np.full(coarse_shape, np.inf)
+    return ndimage.distance_transform_edt(grid_raster) * abs(affine[0]) * k
@@ -1,74 +1,371 @@
+import json
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
 from pathlib import Path
+from tempfile import TemporaryFile
+from typing import Optional, Union
 
 import geopandas as gpd
+import h3
 import h3pandas  # NoQA
+import numpy as np
 import pandas as pd
-from osgeo import gdal
 import rasterio
+import shapely
+from affine import Affine
+from rasterio.crs import CRS
 from rasterio.features import rasterize
 from rasterstats import zonal_stats
 from scipy import ndimage
+from shapely.geometry import Polygon
 from typer import echo
 
+from spider import align, pool, report, zonal
+from spider.cache import (
+    cache_path,
+    evict,
+    file_hash,
+    hash_key,
+    hex_key,
+    load_array,
+    load_column,
+    save_array,
+    save_column,
+    tmp_path,
+)
+from spider.edt import tiled_distance
+
+
+def add_features(
+    geom: gpd.GeoDataFrame,
+    features: list,
+    raster_like: Path,
+    cache_dir: Path = None,
+    cache_size: float = None,
+    jobs: int = 1,
+    column_dir: Path = None,
+    records: list = None,
+    profile_dir: Path = None,
+    align_to: Union[bool, str, dict, None] = None,
+    raw: dict = None,
+) -> gpd.GeoDataFrame:
+    """
+    Add a column to geom for each feature in the config.
+
+    If `column_dir` is given, each feature's values are saved there as soon as
+    they are calculated, keyed by the hexagons, the feature's config and the
+    contents of its input file. Features are only recalculated when one of those
+    changes. Without it, features whose column already exists are skipped.
+
+    With `jobs` > 1, features are calculated in a pool of processes. Each worker
+    gets a copy of the hexagons (as WKB) once, when it starts, and the columns are
+    added back in config order.
+
+    A feature that fails (or whose `decimals` or `fix` fail) is reported and skipped
+    without stopping the others.
+
+    If `records` is given, a record of each calculated feature's time, memory
+    and input sizes is added to it (see `spider.report`), and with `profile_dir`
+    a cProfile dump of each one is saved there.
+
+    The hexagons are only reprojected once for each CRS, and rasters are kept
+    open between the features that read them until the features are done
+    (see `spider.pool`).
+
+    With `align_to` (the `align` config, see `spider.align.get_grid`), raster
+    features are first warped onto that grid and cached in `cache_dir`.
 
-def add_features(geom: gpd.GeoDataFrame, features: list, raster_like: Path):
+    If `raw` is given, the values of each feature added (before `decimals`
+    and `fix` are applied) are added to it.
+    """
+    if column_dir is None:
+        features = [f for f in features if f["name"] not in geom.columns]
+    else:
+        Path(column_dir).mkdir(parents=True, exist_ok=True)
+
+    grid = None
+    if align_to:
+        grid = align.get_grid(align_to, raster_like, geom)
+
+    cols, keys, todo, failed = {}, {}, [], []
     for f in features:
-        try:
+        col_name = f["name"]
+        if column_dir is not None:
+            try:
+                keys[col_name] = column_key(geom, f, raster_like, grid)
+            except Exception as e:
+                echo(f"Error in {col_name}: {e}")
+                failed.append(col_name)
+                continue
+            values = load_column(column_path(column_dir, f), keys[col_name])
+            if values is not None:
+                echo(f"Using saved {col_name}")
+                cols[col_name] = values
+                continue
+        todo.append(f)
+
+    recs = {}
+    with pool.shared():
+        done = calc_features(
+            geom, todo, raster_like, cache_dir, cache_size, jobs, profile_dir, grid
+        )
+        for f, values, rec in done:
             col_name = f["name"]
-            if col_name not in geom.columns:
-                echo(f"Doing {col_name}")
-                if f["type"] == "raster":
-                    geom[col_name] = add_raster_layer(
-                        geom=geom,
-                        raster=Path(f["file"]).expanduser(),
-                        operation=f["operation"],
-                        crs=f["crs"] if "crs" in f.keys() else None,
-                    )
+            recs[col_name] = rec
+            if isinstance(values, Exception):
+                echo(f"Error in {col_name}: {values}")
+                failed.append(col_name)
+                continue
+            values = pd.Series(values, index=geom.index)
+            cols[col_name] = values.to_numpy()
+            if column_dir is not None:
+                save_column(column_path(column_dir, f), values, keys[col_name])
 
-                elif f["type"] == "vector":
-                    geom[col_name] = add_vector_layer(
-                        geom=geom,
-                        vector=Path(f["file"]).expanduser(),
-                        operation=f["operation"],
-                        raster_like=raster_like,
-                        joined_col=f.get("joined_col", None),
-                    )
+    for f in features:
+        col_name = f["name"]
+        if col_name not in cols:
+            continue
+        before = geom[col_name] if col_name in geom.columns else None
+        geom[col_name] = cols[col_name]
+        if raw is not None:
+            raw[col_name] = geom[col_name].to_numpy(copy=True)
+        try:
+            with report.stage("fix_column", recs.get(col_name)):
+                geom[col_name] = finish_feature(geom, f)
+        except Exception as e:
+            echo(f"Error in {col_name}: {e}")
+            failed.append(col_name)
+            if raw is not None:
+                del raw[col_name]
+            if before is None:
+                del geom[col_name]
+            else:
+                geom[col_name] = before
+
+    if records is not None:
+        records.extend(recs[f["name"]] for f in todo if recs.get(f["name"]))
+
+    if failed:
+        echo(f"These features failed and are missing: {', '.join(failed)}")
+    return geom
 
-                else:
-                    raise ValueError("Only 'raster' or 'vector' supported for 'type'.")
-
-                if f.get("decimals"):
-                    geom[col_name] = geom[col_name].fillna(0).round(f["decimals"])
-
-                if "fix" in f:
-                    fix = f["fix"]
-                    geom[col_name] = fix_column(
-                        col=geom[col_name],
-                        pop=geom.Pop if "Pop" in geom.columns else None,
-                        factor=fix.get("factor"),
-                        minimum=fix.get("minimum"),
-                        no_value=fix.get("no_value"),
-                        per_capita=fix.get("per_capita"),
-                    )
+
+def calc_features(
+    geom: gpd.GeoDataFrame,
+    features: list,
+    raster_like: Path,
+    cache_dir: Path,
+    cache_size: float,
+    jobs: int,
+    profile_dir: Path = None,
+    grid: dict = None,
+) -> Iterator[tuple]:
+    """
+    Calculate the raw values for each feature, yielding each feature along with its
+    values (or the exception it raised) and its record (see `measure_feature`)
+    as soon as it is done.
+    """
+    args = (raster_like, cache_dir, cache_size, profile_dir, grid)
+    if jobs <= 1 or len(features) <= 1:
+        for f in features:
+            echo(f"Doing {f['name']}")
+            yield (f, *measure_feature(geom, f, *args))
+        return
+
+    initargs = (
+        geom.geometry.to_wkb().to_numpy(),
+        geom.crs.to_wkt() if geom.crs else None,
+        geom.index.to_numpy(),
+        geom.drop(columns=geom.geometry.name),
+    )
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=initargs) as ex:
+        futures = {ex.submit(calc_feature_worker, f, *args): f for f in features}
+        for fut in as_completed(futures):
+            f = futures[fut]
+            try:
+                values, rec = fut.result()
+            except Exception as e:
+                values, rec = e, None
+            yield f, values, rec
+            if not isinstance(values, Exception):
+                echo(f"Done {f['name']}")
+
+
+def column_path(column_dir: Path, f: dict) -> Path:
+    return Path(column_dir) / f"{f['name']}.npz"
+
+
+def column_key(
+    geom: gpd.GeoDataFrame, f: dict, raster_like: Path, grid: dict = None
+) -> str:
+    """
+    Identify a feature's raw values by the hexagons, the parts of its config
+    that change them (so not `name`, `decimals` or `fix`, which are applied
+    afterwards), the contents of the files it reads and the grid it's aligned to.
+    """
+    config = {k: v for k, v in f.items() if k not in ("name", "decimals", "fix")}
+    files = [file_hash(Path(f["file"]).expanduser())]
+    if f["type"] == "vector" and f["operation"] == "distance":
+        if raster_like is not None and Path(raster_like).exists():
+            files.append(file_hash(raster_like))
+    parts = ["column", hex_key(geom), json.dumps(config, sort_keys=True), files]
+    if aligned(f, grid):
+        parts.append(align.grid_key(grid))
+    return hash_key(*parts)
+
+
+def aligned(f: dict, grid: dict = None) -> bool:
+    """Whether a feature is warped onto the `align` grid first."""
+    return (
+        grid is not None
+        and f["type"] == "raster"
+        and f.get("align", True)
+        and f["operation"] in align.resampling
+    )
+
+
+_worker_geom = None
+
+
+def init_worker(
+    wkb: np.ndarray, crs: Optional[str], index: np.ndarray, attrs: pd.DataFrame
+) -> None:
+    """
+    Rebuild the hexagons once in each worker process, and share their
+    projections and open rasters between the features it does.
+    """
+    global _worker_geom
+    _worker_geom = gpd.GeoDataFrame(
+        attrs, geometry=shapely.from_wkb(wkb), crs=crs, index=index
+    )
+    Finalize(None, pool.start().close, exitpriority=10)
+
+
+def calc_feature_worker(
+    f: dict,
+    raster_like: Path,
+    cache_dir: Path = None,
+    cache_size: float = None,
+    profile_dir: Path = None,
+    grid: dict = None,
+) -> tuple:
+    echo(f"Doing {f['name']}")
+    return measure_feature(
+        _worker_geom, f, raster_like, cache_dir, cache_size, profile_dir, grid
+    )
+
+
+def measure_feature(
+    geom: gpd.GeoDataFrame,
+    f: dict,
+    raster_like: Path,
+    cache_dir: Path = None,
+    cache_size: float = None,
+    profile_dir: Path = None,
+    grid: dict = None,
+) -> tuple:
+    """
+    Calculate a feature, recording its time, memory and input sizes.
+
+    Returns: the values (or the exception raised), and the record
+    """
+    with report.record(f["name"], profile_dir) as rec:
+        report.count(hexagons=len(geom))
+        try:
+            values = calc_feature(geom, f, raster_like, cache_dir, cache_size, grid)
         except Exception as e:
-            echo(f"Error: {e}")
-            echo("Saving result so far and quitting")
-            return geom
+            values = e
+            rec["error"] = str(e)
+    return values, rec
 
-    return geom
+
+def calc_feature(
+    geom: gpd.GeoDataFrame,
+    f: dict,
+    raster_like: Path,
+    cache_dir: Path = None,
+    cache_size: float = None,
+    grid: dict = None,
+) -> list:
+    """Calculate the raw values for one feature from the config."""
+    if f["type"] == "raster":
+        raster = Path(f["file"]).expanduser()
+        if aligned(f, grid):
+            raster = align.align_raster(raster, f["operation"], grid, cache_dir)
+        return add_raster_layer(
+            geom=geom,
+            raster=raster,
+            operation=f["operation"],
+            crs=f["crs"] if "crs" in f.keys() else None,
+            method=f.get("method", "index"),
+            fractional=f.get("fractional", False),
+            cache_dir=cache_dir,
+            overview_tolerance=f.get("overview_tolerance", 0.05),
+        )
+
+    elif f["type"] == "vector":
+        return add_vector_layer(
+            geom=geom,
+            vector=Path(f["file"]).expanduser(),
+            operation=f["operation"],
+            raster_like=raster_like,
+            joined_col=f.get("joined_col", None),
+            cache_dir=cache_dir,
+            cache_size=cache_size,
+            method=f.get("method", "raster"),
+            memory=f.get("memory", 1024),
+            max_distance=f.get("max_distance"),
+        )
+
+    else:
+        raise ValueError("Only 'raster' or 'vector' supported for 'type'.")
+
+
+def finish_feature(geom: gpd.GeoDataFrame, f: dict) -> pd.Series:
+    """Apply the `decimals` and `fix` settings to a feature's column."""
+    col_name = f["name"]
+    col = geom[col_name]
+    if f.get("decimals"):
+        col = col.fillna(0).round(f["decimals"])
+
+    if "fix" in f:
+        fix = f["fix"]
+        col = fix_column(
+            col=col,
+            pop=geom.Pop if "Pop" in geom.columns else None,
+            factor=fix.get("factor"),
+            minimum=fix.get("minimum"),
+            no_value=fix.get("no_value"),
+            per_capita=fix.get("per_capita"),
+        )
+    return col
 
 
-def create_hex(aoi: gpd.GeoDataFrame, resolution=5, min_buffer=0, step=500):
+def create_hex(
+    aoi: gpd.GeoDataFrame,
+    resolution: int = 5,
+    min_buffer: float = 0,
+    step: float = 500,
+    method: str = "overlap",
+) -> gpd.GeoDataFrame:
     """
-    Create hexagons to cover the AOI, optimizing the buffer size to ensure full coverage.
+    Create hexagons to cover the AOI.
 
     Parameters:
     - aoi: GeoDataFrame containing the area of interest (Laos)
     - resolution: H3 resolution for hexagon creation
-    - min_buffer: Starting buffer size in meters
-    - step: Incremental step for increasing buffer size in meters
+    - min_buffer: Starting buffer size in meters (only for 'buffer')
+    - step: Incremental step for increasing buffer size in meters (only for 'buffer')
+    - method: Either 'overlap' (default) to take every cell that touches the AOI
+      in a single pass, or 'buffer' to grow the AOI until the cells cover it.
     """
-    projected_crs = 'EPSG:4088'
+    if method == "overlap":
+        return create_hex_overlap(aoi, resolution)
+    elif method != "buffer":
+        raise ValueError("Only 'overlap' or 'buffer' supported for 'method'.")
+
+    projected_crs = "EPSG:4088"
     aoi_projected = aoi.to_crs(projected_crs)
 
     buffer_size = min_buffer
@@ -76,7 +373,7 @@ def create_hex(aoi: gpd.GeoDataFrame, resolution=5, min_buffer=0, step=500):
 
     while True:
         aoi_buffered = aoi_projected.copy()
-        aoi_buffered['geometry'] = aoi_buffered.geometry.buffer(buffer_size)
+        aoi_buffered["geometry"] = aoi_buffered.geometry.buffer(buffer_size)
 
         aoi_buffered = aoi_buffered.to_crs(epsg=4326)
         hex_geom = aoi_buffered.h3.polyfill_resample(resolution).get(["geometry"])
@@ -93,10 +390,127 @@ def create_hex(aoi: gpd.GeoDataFrame, resolution=5, min_buffer=0, step=500):
     return hex_geom
 
 
+def create_hex_overlap(
+    aoi: gpd.GeoDataFrame, resolution: int = 5, fill_rounds: int = 5
+) -> gpd.GeoDataFrame:
+    """
+    Create the minimal set of hexagons covering the AOI, without a search loop.
+
+    Every cell that overlaps the AOI is taken in one polyfill. H3 cell edges are
+    geodesic while the AOI edges are planar in EPSG:4326, so a few slivers along
+    the boundary can still be left uncovered: the cells around those slivers
+    are then filled in, and the coverage is checked again. If the AOI still
+    isn't covered after `fill_rounds`, this falls back to the 'buffer' method.
+
+    Parameters:
+    - aoi: GeoDataFrame containing the area of interest
+    - resolution: H3 resolution for hexagon creation
+    - fill_rounds: How many times to fill in boundary cells before falling back
+    """
+    aoi = aoi.to_crs(epsg=4326)
+
+    cells = set()
+    for geom in aoi.geometry:
+        if geom is None or geom.is_empty:
+            continue
+        shape = h3.geo_to_h3shape(geom)
+        cells.update(h3.h3shape_to_cells_experimental(shape, resolution, "overlap"))
+
+    hex_geom = cells_to_hex(cells)
+    missing = uncovered(aoi, hex_geom)
+    for _ in range(fill_rounds):
+        if missing.is_empty:
+            break
+        filled = boundary_cells(missing, resolution) - cells
+        if not filled:
+            break
+        print(f"Filled in {len(filled)} boundary cells")
+        cells |= filled
+        hex_geom = cells_to_hex(cells)
+        missing = uncovered(aoi, hex_geom)
+
+    if not missing.is_empty:
+        print("Hexagons don't cover the AOI, falling back to the buffer method")
+        return create_hex(aoi, resolution, method="buffer")
+
+    print(f"Created {len(hex_geom)} hexagons")
+    return hex_geom
+
+
+def boundary_cells(missing: shapely.Geometry, resolution: int) -> set:
+    """
+    Get the cells that touch the uncovered parts of the AOI: the cells
+    containing their vertices and a point inside each part, and any neighbors
+    of those cells that intersect the parts.
+    """
+    parts = shapely.get_parts(missing)
+    points = shapely.get_coordinates(
+        np.concatenate([parts, shapely.point_on_surface(parts)])
+    )
+    found = {h3.latlng_to_cell(lat, lng, resolution) for lng, lat in points}
+    around = sorted({n for c in found for n in h3.grid_disk(c, 1)} - found)
+    if around:
+        shapely.prepare(missing)
+        hits = shapely.intersects(missing, cell_polygons(around))
+        found.update(c for c, hit in zip(around, hits) if hit)
+    return found
+
+
+def cells_to_hex(cells: Iterable[str]) -> gpd.GeoDataFrame:
+    """
+    Create a hex geometry with an `h3_index` column from a collection of H3 cells.
+    """
+    cells = sorted(cells)
+    return gpd.GeoDataFrame(
+        {"h3_index": cells}, geometry=cell_polygons(cells), crs=4326
+    ).get(["geometry", "h3_index"])
+
+
+def cell_polygons(cells: Iterable[str]) -> list:
+    """
+    Get the hexagon (or pentagon) polygon for each H3 cell, in EPSG:4326.
+    """
+    return [Polygon([(lng, lat) for lat, lng in h3.cell_to_boundary(c)]) for c in cells]
+
+
+def uncovered(
+    original_aoi: gpd.GeoDataFrame, hex_geom: gpd.GeoDataFrame
+) -> shapely.Geometry:
+    """
+    Get the part of the AOI that is not covered by the hexagons.
+
+    Coordinates are snapped to a 1e-9 degree grid (well under a millimetre),
+    so floating point gaps between neighboring cells are ignored.
+    """
+    hexes = union_hex(hex_geom)
+    aoi = shapely.union_all(original_aoi.to_crs(hex_geom.crs).geometry.values)
+    return shapely.difference(aoi, hexes, grid_size=1e-9)
+
+
+def union_hex(hex_geom: gpd.GeoDataFrame) -> shapely.Geometry:
+    """
+    Merge hexagons into a single geometry.
+
+    The hexagons don't overlap, so when they form a valid coverage (neighbors
+    share exact edges) they are merged with a coverage union, which is much
+    cheaper than a general union. Cells that cross icosahedron faces don't
+    always share exact vertices with their neighbors, in which case this uses
+    a general union.
+    """
+    values = hex_geom.geometry.values
+    if shapely.coverage_is_valid(values):
+        return shapely.coverage_union_all(values)
+    return shapely.union_all(values)
+
+
 def check_coverage(original_aoi: gpd.GeoDataFrame, hex_geom: gpd.GeoDataFrame) -> bool:
     """
     Check if the generated hexagons fully cover the original AOI.
 
+    The hexagons are only merged once and prepared,
+    and then checked against all AOI geometries at once.
+    If that fails, the leftover area is checked with a snapping tolerance.
+
     Parameters:
     - original_aoi: The original area of interest without buffering
     - hex_geom: GeoDataFrame containing the generated hexagons
@@ -104,8 +518,12 @@ def check_coverage(original_aoi: gpd.GeoDataFrame, hex_geom: gpd.GeoDataFrame) -
     Returns:
     - True if the hexagons fully cover the AOI, False otherwise.
     """
-    covered = original_aoi.geometry.apply(lambda geom: hex_geom.unary_union.covers(geom))
-    return covered.all()
+    hexes = union_hex(hex_geom)
+    shapely.prepare(hexes)
+    aoi = original_aoi.to_crs(hex_geom.crs).geometry.values
+    if shapely.covers(hexes, aoi).all():
+        return True
+    return uncovered(original_aoi, hex_geom).is_empty
 
 
 def add_raster_layer(
@@ -115,6 +533,10 @@ def add_raster_layer(
     affine=None,
     crs=None,
     decimals=2,
+    method: str = "index",
+    fractional: bool = False,
+    cache_dir: Path = None,
+    overview_tolerance: float = 0.05,
 ) -> list:
     """
     Add a raster layer
@@ -127,13 +549,26 @@ def add_raster_layer(
         Either a path to the raster, or numpy.ndarray with the data.
     operation: str
         The operation to perform when extracting the raster data.
-        Either 'sum', 'max', or 'mean'
+        Either 'sum', 'max', 'min', 'count' or 'mean'
     col_name: str
         Name of the column to add.
     affine: affine.Affine(), optional
         If a numpy ndarray is passed above, the affine is also needed.
     crs: proj.crs, optional
         Override raster's reported crs
+    method: str, optional (default 'index')
+        Either 'index' to use a hex-pixel index (shared by every raster on the
+        same grid) or 'zonal_stats' to use rasterstats directly.
+    fractional: bool, optional (default False)
+        Only for 'index': weight pixels by how much of them each hexagon covers,
+        rather than assigning them to the hexagon containing their centre.
+    cache_dir: pathlib.Path, optional
+        Directory in which to cache hex-pixel indexes.
+    overview_tolerance: float, optional (default 0.05)
+        Only for 'index' with 'mean': read from the raster's coarsest overview
+        for which at most this share of each hexagon is in pixels crossing its
+        edge (see `spider.zonal.overview_level`), or 0 to always read the full
+        resolution. Other operations always use the full resolution.
     """
 
     if isinstance(raster, Path):
@@ -141,10 +576,27 @@ def add_raster_layer(
     if isinstance(raster, str):
         # rasterstats doesn't check for same CRS
         # Throws memory error if don't ensure they are same
-        if not crs:
-            crs = rasterio.open(raster).crs
-        geom_proj = geom.to_crs(crs)
-        stats = zonal_stats(geom_proj, raster, stats=operation)
+        with pool.dataset(raster) as rd:
+            if not crs:
+                crs = rd.crs
+            geom_proj = pool.to_crs(geom, crs)
+
+            if method == "index" and operation in zonal.operations:
+                level = zonal.overview_level(
+                    rd, geom_proj, operation, overview_tolerance
+                )
+                if level is None:
+                    return index_stats(
+                        geom_proj, rd, crs, operation, fractional, cache_dir
+                    )
+                echo(f"Using the {rd.overviews(1)[level]}x overview")
+                with pool.dataset(raster, overview_level=level) as ov:
+                    return index_stats(
+                        geom_proj, ov, crs, operation, fractional, cache_dir
+                    )
+
+        with report.stage("zonal stats"):
+            stats = zonal_stats(geom_proj, raster, stats=operation)
 
         return [x[operation] for x in stats]
 
@@ -152,6 +604,36 @@ def add_raster_layer(
         raise NotImplementedError("Only implemented for path input.")
 
 
+def index_stats(
+    geom: gpd.GeoDataFrame,
+    rd: rasterio.DatasetReader,
+    crs: Union[CRS, str],
+    operation: str,
+    fractional: bool = False,
+    cache_dir: Path = None,
+) -> list:
+    """
+    Calculate a zonal statistic with a hex-pixel index,
+    reading only the window of the raster that covers the hexagons.
+    """
+    with report.stage("zonal index"):
+        index = zonal.get_index(
+            geom,
+            crs,
+            rd.transform,
+            rd.shape,
+            cache_dir=cache_dir,
+            fractional=fractional,
+        )
+    with report.stage("read"):
+        arr = rd.read(1, window=index.window, masked=True)
+    nbytes = arr.size * arr.itemsize
+    echo(f"Read {arr.shape[0]}x{arr.shape[1]} pixels ({nbytes / 2**20:.1f} MB)")
+    report.count(raster_pixels=arr.size, bytes_read=nbytes)
+    with report.stage("zonal stats"):
+        return list(index.reduce(arr, operation))
+
+
 def add_vector_layer(
     geom: gpd.GeoDataFrame,
     vector: Path,
@@ -159,6 +641,11 @@ def add_vector_layer(
     raster_like: Path,
     decimals: int = 2,
     joined_col: str = None,
+    cache_dir: Path = None,
+    cache_size: float = None,
+    method: str = "raster",
+    memory: float = 1024,
+    max_distance: float = None,
 ) -> list:
     """
     Use a vector containing grid infrastructure to determine
@@ -175,46 +662,199 @@ def add_vector_layer(
         Currently only 'distance' and 'sjoin' supported.
     raster_like: file-like
         Raster file to use for crs, shape, affine when rasterizing vector
+    cache_dir: pathlib.Path, optional
+        Directory in which to cache distance rasters (and hex-pixel indexes).
+    cache_size: float, optional
+        Maximum size in MB of the cached distance rasters.
+    method: str, optional (default 'raster')
+        Only for 'distance': either 'raster' to use a distance transform on the
+        `raster_like` grid, or 'vector' to calculate exact distances from each
+        hexagon to the nearest feature without allocating any rasters, or 'tiled'
+        to process the `raster_like` grid in tiles with bounded memory.
+    memory: float, optional (default 1024)
+        Only for 'tiled': the peak memory to aim for in MB.
+    max_distance: float, optional
+        Only for 'tiled': the largest distance (in CRS units) that must be exact.
     """
 
-    geom = geom.copy()
-    vector = gpd.read_file(vector)
-
     assert isinstance(geom, gpd.GeoDataFrame), "geom must be a GeoDataFrame"
 
     if operation == "sjoin":
-        geom = geom.to_crs(4326).sjoin(vector.to_crs(4326))
+        with report.stage("read"):
+            vector = gpd.read_file(vector)
+        report.count(vector_features=len(vector))
+        geom = pool.to_crs(geom, 4326)
+        with report.stage("reproject"):
+            vector = vector.to_crs(4326)
+        with report.stage("sjoin"):
+            geom = geom.sjoin(vector)
         geom = geom[~geom.index.duplicated()][joined_col]
         return geom
 
+    elif operation == "distance" and method == "vector":
+        return list(vector_distance(geom, vector, raster_like))
+
     elif operation == "distance":
-        with rasterio.open(raster_like) as rd:
+        with pool.dataset(raster_like) as rd:
             crs = rd.crs
             affine = rd.transform
             shape = rd.shape
 
+        geom = pool.to_crs(geom, crs)
+        dist_raster = get_dist_raster(
+            vector,
+            crs,
+            affine,
+            shape,
+            cache_dir=cache_dir,
+            cache_size=cache_size,
+            method=method,
+            memory=memory,
+            max_distance=max_distance,
+        )
+
+        with report.stage("zonal index"):
+            index = zonal.get_index(geom, crs, affine, shape, cache_dir=cache_dir)
+        arr = dist_raster[index.window.toslices()]
+        report.count(raster_pixels=arr.size)
+        with report.stage("zonal stats"):
+            return list(index.reduce(arr, "min"))
+
+    else:
+        raise NotImplementedError('Currently only "distance" is supported.')
+
+
+def vector_distance(
+    geom: gpd.GeoDataFrame,
+    vector: Path,
+    raster_like: Path = None,
+    batch_size: int = 50_000,
+) -> np.ndarray:
+    """
+    Calculate the exact minimum distance from each hexagon to the nearest
+    feature in a vector, using nearest neighbour queries on an STRtree.
+
+    Distances are calculated in the CRS of `raster_like` if it exists,
+    otherwise in EPSG:4088 (the same projected CRS used by `create_hex`).
+    Hexagons are queried in batches of `batch_size`.
+    """
+    if raster_like is not None and Path(raster_like).exists():
+        with pool.dataset(raster_like) as rd:
+            crs = rd.crs
+    else:
+        crs = "EPSG:4088"
+
+    with report.stage("read"):
+        vector = gpd.read_file(vector)
+    report.count(vector_features=len(vector))
+    with report.stage("reproject"):
         vector = vector.to_crs(crs=crs)
-        geom = geom.to_crs(crs=crs)
+    hexes = pool.to_crs(geom, crs).geometry.values
+    vector = vector.loc[vector.geometry.notna() & ~vector.geometry.is_empty]
+
+    dists = np.full(len(hexes), np.nan)
+    if len(vector) == 0:
+        return dists
+    with report.stage("nearest"):
+        tree = shapely.STRtree(vector.geometry.values)
+        for start in range(0, len(hexes), batch_size):
+            (idx, _), dist = tree.query_nearest(
+                hexes[start : start + batch_size],
+                return_distance=True,
+                all_matches=False,
+            )
+            dists[start + idx] = dist
+    return dists
+
+
+def get_dist_raster(
+    vector: Path,
+    crs: CRS,
+    affine: Affine,
+    shape: tuple,
+    cache_dir: Path = None,
+    cache_size: float = None,
+    method: str = "raster",
+    memory: float = 1024,
+    max_distance: float = None,
+) -> np.ndarray:
+    """
+    Rasterize a vector onto a grid and calculate every pixel's distance to it.
 
-        vector = vector.loc[vector["geometry"].length > 0]
+    If `cache_dir` is given, the result is cached as a memory-mappable .npy keyed
+    by the vector's contents, the grid and the rasterize options, so unchanged
+    vectors are never read or rasterized again.
+    The least recently used rasters are evicted to keep them under `cache_size` MB.
 
-        grid_raster = rasterize(
-            vector.geometry,
-            out_shape=shape,
-            fill=1,
-            default_value=0,
-            all_touched=True,
-            transform=affine,
-        )
-        dist_raster = ndimage.distance_transform_edt(grid_raster) * affine[0]
+    With method 'tiled', the grid is processed in tiles to keep peak memory
+    around `memory` MB, and the result is written straight into a memory-mapped
+    file (see `spider.edt.tiled_distance` for how `max_distance` is used).
 
-        dists = zonal_stats(
-            vectors=geom, raster=dist_raster, affine=affine, stats="min", nodata=-999
+    Returns: the distances as float32, in CRS units
+    """
+    options = dict(fill=1, default_value=0, all_touched=True)
+    tiled = dict(memory=memory, max_distance=max_distance) if method == "tiled" else {}
+
+    path = None
+    if cache_dir is not None:
+        key = hash_key(
+            "distance",
+            file_hash(vector),
+            str(crs),
+            tuple(affine),
+            tuple(shape),
+            sorted(options.items()),
+            sorted(tiled.items()),
         )
-        return [x["min"] for x in dists]
+        path = cache_path(cache_dir, "distance", key, ".npy")
+        if path.exists():
+            echo("Using cached distance raster")
+            return load_array(path)
+
+    with report.stage("read"):
+        vector = gpd.read_file(vector)
+    report.count(vector_features=len(vector))
+    with report.stage("reproject"):
+        vector = vector.to_crs(crs=crs)
+    vector = vector.loc[vector["geometry"].length > 0]
+
+    if method == "tiled":
+        if path is not None:
+            tmp = tmp_path(path)
+            out = np.lib.format.open_memmap(
+                tmp, mode="w+", dtype="float32", shape=shape
+            )
+        else:
+            out = np.memmap(TemporaryFile(), mode="w+", dtype="float32", shape=shape)
+        with report.stage("rasterize and EDT"):
+            dist_raster = tiled_distance(vector, affine, shape, out, **tiled, **options)
+        dist_raster.flush()
+        if path is not None:
+            del dist_raster, out
+            tmp.replace(path)
+            dist_raster = load_array(path)
+
+    elif method == "raster":
+        with report.stage("rasterize"):
+            grid_raster = rasterize(
+                vector.geometry,
+                out_shape=shape,
+                transform=affine,
+                **options,
+            )
+        with report.stage("EDT"):
+            dist_raster = ndimage.distance_transform_edt(grid_raster) * affine[0]
+        # float32 like the cached and tiled ones, so results don't depend on the cache
+        dist_raster = dist_raster.astype("float32")
+        if path is not None:
+            save_array(path, dist_raster)
 
     else:
-        raise NotImplementedError('Currently only "distance" is supported.')
+        raise ValueError("Only 'raster', 'tiled' or 'vector' supported for 'method'.")
+
+    if path is not None and cache_size is not None:
+        evict(cache_dir, "distance", int(cache_size * 2**20))
+    return dist_raster
 
 
 def fix_column(
@@ -0,0 +1,324 @@
+import gzip
+import json
+from collections.abc import Iterator, Sequence
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from spider.features import cell_polygons
+
+formats = {
+    ".geojson": "GeoJSON",
+    ".parquet": "Parquet",
+    ".arrow": "Arrow",
+    ".feather": "Arrow",
+}
+
+sidecars = {
+    "gzip": ".gz",
+    "brotli": ".br",
+}
+
+
+def check_format(file: Path) -> None:
+    if Path(file).suffix not in formats:
+        raise ValueError(
+            f"Output must be one of {', '.join(formats)}! eg 'processed/hex.geojson'"
+        )
+
+
+def write_hex(
+    geom: gpd.GeoDataFrame,
+    file: Path,
+    geometry: bool = True,
+    decimals: dict = None,
+    coord_decimals: int = 6,
+    compress: Sequence[str] = (),
+) -> None:
+    """
+    Save a hex geometry, with the format chosen by the file's suffix.
+
+    Parquet (GeoParquet) and Arrow IPC/Feather files have their columns narrowed
+    to float32/int32 where no values change, and can leave out the geometry
+    (`geometry=False`), in which case it is rebuilt from `h3_index` when read.
+
+    Parameters
+    ----------
+    geom: geopandas.GeoDataFrame
+        The hex geometry.
+    file: pathlib.Path
+        File to write, ending in .geojson, .parquet, .arrow or .feather.
+    geometry: bool, optional (default True)
+        Whether to include the geometry (not supported for GeoJSON).
+    decimals: dict, optional
+        Number of decimals each column has been rounded to.
+        Only columns in here can be narrowed to float32.
+    coord_decimals: int, optional (default 6)
+        Number of decimals to keep in GeoJSON coordinates.
+    compress: list of str, optional
+        Also save compressed copies of a GeoJSON ('gzip' and/or 'brotli').
+    """
+    check_format(file)
+    fmt = formats[Path(file).suffix]
+    if fmt == "GeoJSON":
+        if not geometry:
+            raise ValueError("GeoJSON must have a geometry")
+        write_geojson(
+            geom,
+            file,
+            decimals=decimals,
+            coord_decimals=coord_decimals,
+            compress=compress,
+        )
+        return
+
+    geom = narrow(geom, decimals or {})
+    if not geometry:
+        if "h3_index" not in geom.columns:
+            raise ValueError("Need an 'h3_index' column to leave out the geometry")
+        geom = pd.DataFrame(geom.drop(columns=geom.geometry.name))
+
+    if fmt == "Parquet":
+        geom.to_parquet(file)
+    else:
+        geom.to_feather(file)
+
+
+def write_geojson(
+    geom: gpd.GeoDataFrame,
+    file: Path,
+    decimals: dict = None,
+    coord_decimals: int = 6,
+    compress: Sequence[str] = (),
+    chunk_size: int = 10_000,
+) -> None:
+    """
+    Write a GeoJSON a chunk of features at a time, without going through OGR.
+
+    Coordinates are rounded to `coord_decimals` (6 is about 10 cm) and columns in
+    `decimals` to their number of decimals, and numbers are written as briefly
+    as possible, which makes the file a fraction of the size `to_file` gives.
+    Compressed copies (eg hex.geojson.gz) are written at the same time
+    for static hosts that can serve pre-compressed files.
+    """
+    decimals = decimals or {}
+    if geom.crs is not None and not geom.crs.equals(4326):
+        geom = geom.to_crs(4326)
+    props = pd.DataFrame(geom.drop(columns=geom.geometry.name))
+    shapes = geom.geometry.values
+
+    with ExitStack() as stack:
+        writers = [stack.enter_context(open(file, "wb")).write]
+        writers += [open_sidecar(file, method, stack) for method in compress]
+
+        def write(text: str) -> None:
+            data = text.encode()
+            for w in writers:
+                w(data)
+
+        write('{"type":"FeatureCollection","features":[\n')
+        for start in range(0, len(geom), chunk_size):
+            chunk = props.iloc[start : start + chunk_size].copy()
+            for col, dec in decimals.items():
+                if dec is not None and col in chunk.columns:
+                    chunk[col] = chunk[col].round(dec)
+            # JSON has no NaN or infinity, so those are written as null
+            chunk = chunk.replace([np.inf, -np.inf], np.nan)
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            records = [
+                json.dumps(r, separators=(",", ":"), allow_nan=False)
+                for r in chunk.to_dict("records")
+            ]
+            geoms = shapely.to_geojson(
+                shapely.transform(
+                    shapes[start : start + chunk_size],
+                    lambda c: np.round(c, coord_decimals),
+                )
+            )
+            sep = ",\n" if start > 0 else ""
+            write(
+                sep
+                + ",\n".join(
+                    f'{{"type":"Feature","properties":{p},"geometry":{g or "null"}}}'
+                    for p, g in zip(records, geoms)
+                )
+            )
+        write("\n]}\n")
+
+
+def open_sidecar(file: Path, method: str, stack: ExitStack) -> Callable:
+    """
+    Open a compressed copy of `file` to write to,
+    closing it when `stack` is closed.
+    """
+    if method not in sidecars:
+        raise ValueError(f"Compression must be one of {', '.join(sidecars)}")
+    path = f"{file}{sidecars[method]}"
+    if method == "gzip":
+        return stack.enter_context(gzip.open(path, "wb", compresslevel=6)).write
+
+    try:
+        import brotli
+    except ImportError as e:
+        raise ImportError(
+            "Brotli compression needs the 'brotli' package (pip install brotli)"
+        ) from e
+    out = stack.enter_context(open(path, "wb"))
+    compressor = brotli.Compressor(quality=11)
+    stack.callback(lambda: out.write(compressor.finish()))
+    return lambda data: out.write(compressor.process(data))
+
+
+def read_hex(file: Path) -> gpd.GeoDataFrame:
+    """
+    Load a hex geometry saved with `write_hex`.
+    """
+    check_format(file)
+    fmt = formats[Path(file).suffix]
+    if fmt == "GeoJSON":
+        return gpd.read_file(file)
+
+    try:
+        if fmt == "Parquet":
+            return gpd.read_parquet(file)
+        return gpd.read_feather(file)
+    except ValueError:
+        # no geometry, so rebuild it from the H3 cells
+        df = pd.read_parquet(file) if fmt == "Parquet" else pd.read_feather(file)
+        return gpd.GeoDataFrame(
+            df, geometry=cell_polygons(df["h3_index"]), crs=4326, index=df.index
+        )
+
+
+def narrow(df: pd.DataFrame, decimals: dict) -> pd.DataFrame:
+    """
+    Convert int64 columns to int32 if they fit, and float64 columns that have been
+    rounded to `decimals` to float32 if they still round to the same values.
+    """
+    df = df.copy()
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if values.dtype == np.int64:
+            info = np.iinfo(np.int32)
+            if len(values) == 0 or (
+                values.min() >= info.min and values.max() <= info.max
+            ):
+                df[col] = values.astype(np.int32)
+        elif values.dtype == np.float64 and decimals.get(col) is not None:
+            narrowed = values.astype(np.float32)
+            roundtrip = np.round(narrowed.astype(np.float64), decimals[col])
+            if np.array_equal(roundtrip, values, equal_nan=True):
+                df[col] = narrowed
+    return df
+
+
+def iter_hex(
+    file: Path, columns: Optional[list] = None, chunk_size: int = 100_000
+) -> Iterator[pd.DataFrame]:
+    """
+    Read the attributes (not the geometry) of a hex file a chunk at a time.
+
+    Parameters
+    ----------
+    file: pathlib.Path
+        File in any of the formats `write_hex` supports.
+    columns: list, optional
+        Columns to read (any that aren't in the file are skipped).
+    chunk_size: int, optional (default 100_000)
+        Number of hexagons per chunk.
+    """
+    check_format(file)
+    fmt = formats[Path(file).suffix]
+    if fmt == "GeoJSON":
+        import pyogrio
+
+        if columns:
+            fields = pyogrio.read_info(file)["fields"]
+            columns = [c for c in columns if c in fields]
+        # GDAL won't read no columns at all, so read the feature IDs instead
+        fids = columns == []
+        with pyogrio.open_arrow(
+            file,
+            columns=columns,
+            read_geometry=False,
+            return_fids=fids,
+            batch_size=chunk_size,
+            use_pyarrow=True,
+        ) as (_, reader):
+            for batch in reader:
+                df = batch.to_pandas()
+                yield df.iloc[:, :0] if fids else df
+        return
+
+    import pyarrow.parquet as pq
+    from pyarrow import ipc
+
+    if fmt == "Parquet":
+        schema = pq.read_schema(file)
+    else:
+        reader = ipc.open_file(file)
+        schema = reader.schema
+    if columns:
+        columns = [c for c in columns if c in schema.names]
+
+    if fmt == "Parquet":
+        batches = pq.ParquetFile(file).iter_batches(chunk_size, columns=columns)
+    else:
+        batches = (
+            batch.slice(start, chunk_size)
+            for i in range(reader.num_record_batches)
+            for batch in [reader.get_batch(i)]
+            for start in range(0, batch.num_rows, chunk_size)
+        )
+    for batch in batches:
+        yield (batch.select(columns) if columns else batch).to_pandas()
+
+
+@contextmanager
+def table_writer(file: Path) -> Iterator[Callable]:
+    """
+    Open a table (.parquet, .arrow, .feather or .csv) to write a DataFrame
+    to at a time, eg `with table_writer(file) as write: write(df)`.
+    All the DataFrames must have the same columns.
+    """
+    suffix = Path(file).suffix
+    if suffix == ".csv":
+        first = True
+
+        def write_csv(df: pd.DataFrame) -> None:
+            nonlocal first
+            df.to_csv(file, mode="w" if first else "a", header=first, index=False)
+            first = False
+
+        yield write_csv
+        return
+
+    if suffix not in (".parquet", ".arrow", ".feather"):
+        raise ValueError("Output must be .parquet, .arrow, .feather or .csv")
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pyarrow import ipc
+
+    with ExitStack() as stack:
+        writer = schema = None
+
+        def write_table(df: pd.DataFrame) -> None:
+            nonlocal writer, schema
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = stack.enter_context(
+                    pq.ParquetWriter(file, table.schema)
+                    if suffix == ".parquet"
+                    else ipc.new_file(file, table.schema)
+                )
+            # later chunks might come out as eg int rather than float
+            writer.write_table(table.cast(schema))
+
+        yield write_table
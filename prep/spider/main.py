@@ -1,51 +1,391 @@
+import asyncio
+import json
+import sys
+import time
 from pathlib import Path
+from typing import Optional
 
 import geopandas as gpd
 import yaml
-from typer import Option, echo, run
+from typer import Option, Typer, echo
 
+from spider.bench import compare, run_bench
+from spider.bench import save_report as save_bench
+from spider.draw import apply_lines
 from spider.features import add_features, create_hex
+from spider.formats import check_format, formats, read_hex, sidecars, write_hex
+from spider.montecarlo import get_distributions, run_montecarlo
 from spider.neighbors import add_neighbors
+from spider.pyramid import (
+    check_levels,
+    level_path,
+    make_level,
+    missing_raw,
+    weight_features,
+)
+from spider.report import record, save_report, stage
+from spider.run import get_pars, load_app_config, load_model, run_model
+from spider.server import AppModel, serve
+from spider.sweep import get_scenarios, run_sweep
+from spider.tiles import write_tiles
 
 cfg_default = Path(__file__).parents[1] / "config.yml"
 
+app = Typer(add_completion=False)
 
+
+@app.command()
 def feat(
     file: Path,
     config: Path = Option(cfg_default, help="Path to config file"),
     append: bool = Option(False),
+    jobs: int = Option(1, "--jobs", "-j", help="Number of features to do at once"),
+    reuse: bool = Option(True, help="Reuse saved features that haven't changed"),
+    also: list[Path] = Option([], help="Other files to save to (in any format)"),
+    geometry: bool = Option(True, help="Include geometry (Parquet/Arrow only)"),
+    compress: list[str] = Option(
+        [], help="Also save GeoJSON compressed with 'gzip' and/or 'brotli'"
+    ),
+    report: Optional[Path] = Option(
+        None, help="Save the time and memory of each feature (.json or .csv)"
+    ),
+    profile: Optional[Path] = Option(
+        None, help="Directory to save a cProfile dump of each feature to"
+    ),
+    tiles: Optional[Path] = Option(
+        None, help="Also save the hexagons split into tiles in this directory"
+    ),
+    tile_res: Optional[int] = Option(
+        None, help="H3 resolution of the tiles (default is hex_res - 4)"
+    ),
 ) -> None:
     """Add features."""
 
     file = Path(file)
-    if file.suffix != ".geojson":
-        echo("File must be a GeoJSON! eg 'processed/hex.geojson'")
+    try:
+        for f in [file, *also]:
+            check_format(f)
+        for method in compress:
+            if method not in sidecars:
+                raise ValueError(f"Compression must be one of {', '.join(sidecars)}")
+        if report is not None and report.suffix not in (".json", ".csv"):
+            raise ValueError("Report must be .json or .csv")
+    except ValueError as e:
+        echo(e)
         return
 
     with config.open() as f:
         cfg = yaml.safe_load(f)
+    if tile_res is None:
+        tile_res = max(0, cfg["hex_res"] - 4)
+    try:
+        check_levels(cfg.get("pyramid"), cfg["hex_res"])
+        if tiles is not None and not 0 <= tile_res < cfg["hex_res"]:
+            raise ValueError(f"--tile-res must be from 0 to {cfg['hex_res'] - 1}")
+    except ValueError as e:
+        echo(e)
+        return
+
+    records: list = []
+    with record("run") as run:
+        geom = make_hex(
+            file,
+            cfg,
+            append,
+            jobs,
+            reuse,
+            also,
+            geometry,
+            compress,
+            records,
+            profile,
+            tiles,
+            tile_res,
+        )
+    if report is not None:
+        save_report(
+            {**run, "file": str(file), "hexagons": len(geom), "features": records},
+            report,
+        )
+        echo(f"Saved run report to {report}")
+
+
+def make_hex(
+    file: Path,
+    cfg: dict,
+    append: bool,
+    jobs: int,
+    reuse: bool,
+    also: list,
+    geometry: bool,
+    compress: list,
+    records: list,
+    profile_dir: Optional[Path],
+    tiles: Optional[Path] = None,
+    tile_res: int = 0,
+) -> gpd.GeoDataFrame:
+    """
+    Create (or load) the hexagons, add the features and save them,
+    along with any coarser `pyramid` levels and tiles.
+    """
+    levels = check_levels(cfg.get("pyramid"), cfg["hex_res"])
+    features = cfg.get("features")
+    if not isinstance(features, list):
+        features = None
+    # means are weighted by their number of pixels in the coarser levels
+    extra = weight_features(features) if levels and features else []
 
     if append and file.exists():
         echo("Loading and appending to existing file")
-        geom = gpd.read_file(file)
+        with stage("read"):
+            geom = read_hex(file)
     else:
         echo("Creating a new hex geometry from scratch")
         geom = gpd.read_file(cfg["aoi"])
-        geom = create_hex(geom, cfg["hex_res"],0,500)
-        geom = add_neighbors(geom)
+        with stage("create_hex"):
+            geom = create_hex(
+                geom, cfg["hex_res"], method=cfg.get("hex_coverage", "overlap")
+            )
+        with stage("add_neighbors"):
+            geom = add_neighbors(geom)
 
-    if "features" in cfg and isinstance(cfg["features"], list):
+    raw: dict = {}
+    if features:
         echo("Adding features...")
-        geom = add_features(geom, cfg["features"], cfg["raster_like"])
+        with stage("add_features"):
+            geom = add_features(
+                geom,
+                features + extra,
+                cfg["raster_like"],
+                cache_dir=Path(cfg.get("cache_dir", "cache")).expanduser(),
+                cache_size=cfg.get("cache_size"),
+                jobs=jobs,
+                column_dir=file.with_suffix(".columns") if reuse else None,
+                records=records,
+                profile_dir=profile_dir,
+                align_to=cfg.get("align"),
+                raw=raw,
+            )
     else:
         echo("No features to add")
 
+    geom = geom.drop(columns=[f["name"] for f in extra if f["name"] in geom])
     geom["index"] = geom.index
     geom = geom.dropna(axis=0, subset=["geometry"])
 
-    echo(f"Saving to {file}")
-    geom.to_file(file, driver="GeoJSON")
+    # columns that `fix` rescales aren't at `decimals` precision any more
+    decimals = {
+        f["name"]: f["decimals"]
+        for f in features or []
+        if f.get("decimals") and not {"factor", "per_capita"} & set(f.get("fix") or {})
+    }
+
+    def save(hexes: gpd.GeoDataFrame, files: list) -> None:
+        for f in files:
+            echo(f"Saving to {f}")
+            with stage("write"):
+                write_hex(
+                    hexes,
+                    f,
+                    geometry=geometry or formats[f.suffix] == "GeoJSON",
+                    decimals=decimals,
+                    coord_decimals=cfg.get("coord_decimals", 6),
+                    compress=compress,
+                )
+
+    save(geom, [file, *also])
+    if tiles is not None:
+        echo(f"Saving tiles to {tiles}")
+        with stage("tiles"):
+            manifest = write_tiles(
+                geom,
+                tiles,
+                tile_res,
+                decimals=decimals,
+                coord_decimals=cfg.get("coord_decimals", 6),
+                compress=compress,
+            )
+        echo(f"Saved {len(manifest['tiles'])} tiles")
+    missing = missing_raw(geom, raw, features or []) if levels else []
+    if missing:
+        echo(
+            "Can't make the pyramid levels without the raw values of "
+            f"{', '.join(missing)} (eg columns already in an --append file "
+            "with --no-reuse)"
+        )
+        levels = []
+    for res in levels:
+        echo(f"Making resolution {res} from resolution {cfg['hex_res']}")
+        with stage("pyramid"):
+            level = make_level(geom, raw, features or [], res)
+        level["index"] = level.index
+        save(level, [level_path(f, res) for f in [file, *also]])
+    return geom
+
+
+@app.command()
+def draw(
+    file: Path,
+    lines: Path,
+    out: Optional[Path] = Option(None, help="File to save to (default is FILE)"),
+    config: Optional[Path] = Option(None, help="App config to get hexSize from"),
+    hex_size: Optional[float] = Option(None, help="Distance to add per ring"),
+) -> None:
+    """Apply lines drawn in the app to a hex file."""
+
+    out = out or file
+    try:
+        check_format(out)
+    except ValueError as e:
+        echo(e)
+        return
+
+    if hex_size is None:
+        if config is None:
+            echo("Need either --hex-size or --config")
+            return
+        with config.open() as f:
+            hex_size = yaml.safe_load(f)["hexSize"]
+
+    geom = read_hex(file)
+    geom = apply_lines(geom, gpd.read_file(lines), hex_size)
+    echo(f"Saving to {out}")
+    write_hex(geom, out)
+
+
+@app.command()
+def run(
+    config: Path,
+    out: Path,
+    data: Optional[Path] = Option(None, help="Hex file (default is the config's)"),
+    par: list[str] = Option([], "--par", "-p", help="Change a parameter, eg -p a=1"),
+    chunk_size: int = Option(100_000, help="Number of hexagons to do at a time"),
+) -> None:
+    """Run an app model over a hex file."""
+
+    cfg, app_dir = load_app_config(config)
+    try:
+        pars = get_pars(cfg, par)
+    except ValueError as e:
+        echo(e)
+        return
+    model = load_model(app_dir / cfg["model"])
+    data = data or app_dir / cfg["data"]
+
+    echo(f"Running {cfg['model']} on {data}")
+    start = time.perf_counter()
+    n = run_model(model, data, out, pars, chunk_size=chunk_size)
+    secs = time.perf_counter() - start
+    echo(f"Saved {n:,} hexagons to {out} in {secs:.1f}s ({n / secs:,.0f} per second)")
+
+
+@app.command()
+def sweep(
+    config: Path,
+    out: Path,
+    vary: list[str] = Option(
+        ..., help="Parameter to vary over its range, or a list, eg a=1,2,3"
+    ),
+    steps: int = Option(5, help="Number of values for each range"),
+    data: Optional[Path] = Option(None, help="Hex file (default is the config's)"),
+    par: list[str] = Option([], "--par", "-p", help="Change a parameter, eg -p a=1"),
+    jobs: int = Option(1, "--jobs", "-j", help="Number of scenarios to do at once"),
+    matrix: Optional[Path] = Option(None, help="Also save every hexagon's results"),
+) -> None:
+    """Run an app model for every combination of some parameters."""
+
+    cfg, app_dir = load_app_config(config)
+    data = data or app_dir / cfg["data"]
+    start = time.perf_counter()
+    try:
+        scenarios = get_scenarios(cfg, get_pars(cfg, par), vary, steps)
+        echo(f"Running {cfg['model']} on {data} for {len(scenarios)} scenarios")
+        run_sweep(app_dir / cfg["model"], data, out, scenarios, jobs, matrix)
+    except ValueError as e:
+        echo(e)
+        return
+    echo(f"Saved summaries to {out} in {time.perf_counter() - start:.1f}s")
+
+
+@app.command()
+def mc(
+    config: Path,
+    out: Path,
+    dist: list[str] = Option(
+        ..., help="Distribution for a parameter, eg a=uniform or a=normal:5,1"
+    ),
+    samples: int = Option(1000, help="Number of samples"),
+    quantiles: str = Option("0.05,0.5,0.95", help="Quantiles to save"),
+    seed: Optional[int] = Option(None, help="Seed for the random numbers"),
+    data: Optional[Path] = Option(None, help="Hex file (default is the config's)"),
+    par: list[str] = Option([], "--par", "-p", help="Change a parameter, eg -p a=1"),
+    memory: float = Option(1024, help="Memory for the hexagons being run (MB)"),
+) -> None:
+    """Run an app model with parameters sampled from distributions."""
+
+    cfg, app_dir = load_app_config(config)
+    data = data or app_dir / cfg["data"]
+    start = time.perf_counter()
+    try:
+        pars = get_pars(cfg, par)
+        dists = get_distributions(cfg, dist)
+        qs = [float(q) for q in quantiles.split(",")]
+        echo(f"Running {cfg['model']} on {data} for {samples:,} samples")
+        model = load_model(app_dir / cfg["model"])
+        run_montecarlo(model, data, out, pars, dists, samples, qs, seed, memory=memory)
+    except ValueError as e:
+        echo(e)
+        return
+    echo(f"Saved quantiles to {out} in {time.perf_counter() - start:.1f}s")
+
+
+@app.command("serve")
+def serve_models(
+    configs: list[Path],
+    host: str = Option("127.0.0.1", help="Address to listen on"),
+    port: int = Option(8000, help="Port to listen on"),
+    cache_mb: int = Option(256, help="Memory for cached results per app (MB)"),
+) -> None:
+    """Run app models on a local server (set `server` in the app config)."""
+
+    apps = {}
+    for config in configs:
+        cfg, app_dir = load_app_config(config)
+        echo(f"Loading {cfg['model']} and {cfg['data']}")
+        apps[cfg["name"]] = AppModel(cfg, app_dir, cache_mb * 2**20)
+    asyncio.run(serve(apps, host, port))
+
+
+@app.command()
+def bench(
+    out: Path,
+    res: list[int] = Option([5, 6, 7, 8], help="H3 resolutions for the prep stages"),
+    model: list[str] = Option(
+        ["fish", "hydro", "irri"], help="Apps to run the models for"
+    ),
+    repeat: int = Option(3, help="Times to run each stage (the fastest is saved)"),
+    size: float = Option(1.0, help="Width of the synthetic AOI in degrees"),
+    folder: Path = Option(Path("bench"), help="Directory for synthetic inputs"),
+    baseline: Optional[Path] = Option(None, help="Earlier report to compare to"),
+) -> None:
+    """Time the prep stages and app models, and save a JSON or CSV report."""
+
+    configs = Path(__file__).parents[2] / "frontend" / "dist" / "config"
+    if out.suffix not in (".json", ".csv"):
+        echo("Report must be .json or .csv")
+        return
+    report = run_bench(folder, res, configs, model, repeat, size)
+    save_bench(report, out)
+    echo(f"Saved report to {out}")
+    if baseline is not None:
+        with baseline.open() as f:
+            for line in compare(report, json.load(f)):
+                echo(line)
 
 
 def cli() -> None:
-    run(feat)
+    # `spi FILE` is short for `spi feat FILE`
+    commands = {c.name or c.callback.__name__ for c in app.registered_commands}
+    if len(sys.argv) > 1 and sys.argv[1] not in commands | {"--help"}:
+        sys.argv.insert(1, "feat")
+    app()
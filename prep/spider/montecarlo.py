@@ -0,0 +1,294 @@
+import time
+from collections.abc import Sequence
+from pathlib import Path
+from types import ModuleType
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from typer import echo
+
+from spider.formats import iter_hex, table_writer
+from spider.run import evaluate, id_cols, to_number
+
+Sampler = Callable[[np.random.Generator, int], np.ndarray]
+
+
+def get_distributions(cfg: dict, specs: list) -> dict:
+    """
+    Get a sampler for each parameter to vary.
+
+    Parameters
+    ----------
+    cfg: dict
+        The app config.
+    specs: list of str
+        As 'name=kind' or 'name=kind:a,b,c', where kind is one of
+        uniform:min,max / normal:mean,sd / triangular:min,mode,max.
+        Without numbers, they come from the slider: its min and max,
+        its val as the mean or mode, and (max - min) / 6 as the sd.
+
+    Returns: dict of name to a function taking (rng, size)
+    """
+    sliders = {p["col"]: p for p in cfg["pars"] if "cats" not in p}
+    dists = {}
+    for spec in specs:
+        name, _, dist = spec.partition("=")
+        kind, _, args = dist.partition(":")
+        if name not in sliders:
+            raise ValueError(
+                f"Can't vary '{name}', must be one of: {', '.join(sliders)}"
+            )
+        s = sliders[name]
+        lo, val, hi = (float(to_number(s[k])) for k in ("min", "val", "max"))
+        defaults = {
+            "uniform": (lo, hi),
+            "normal": (val, (hi - lo) / 6),
+            "triangular": (lo, val, hi),
+        }
+        if kind not in defaults:
+            raise ValueError(
+                f"Distribution for '{name}' must be one of: {', '.join(defaults)}"
+            )
+        vals = tuple(float(a) for a in args.split(",")) if args else defaults[kind]
+        if len(vals) != len(defaults[kind]):
+            raise ValueError(f"'{kind}' needs {len(defaults[kind])} numbers")
+        dists[name] = make_sampler(kind, vals)
+    return dists
+
+
+def make_sampler(kind: str, vals: tuple) -> Sampler:
+    def sample(rng: np.random.Generator, size: int) -> np.ndarray:
+        return getattr(rng, kind)(*vals, size=size)
+
+    return sample
+
+
+class P2Quantiles:
+    """
+    Streaming estimates of some quantiles for many values at once
+    (eg one per hexagon), using the P-square algorithm (Jain & Chlamtac, 1985).
+
+    Each quantile of each value only keeps 5 markers, so memory doesn't grow
+    with the number of samples. Every update is a few NumPy operations over
+    all the values.
+    """
+
+    def __init__(self, quantiles: Sequence[float], n: int) -> None:
+        self.quantiles = np.asarray(quantiles, dtype="float64")
+        self.shape = (len(self.quantiles), n)
+        self.count = 0
+        self.first: list = []
+
+        # the markers' heights and positions, as arrays of shape
+        # (5, quantiles * values), so they can be indexed with one array
+        size = len(self.quantiles) * n
+        self.heights = np.zeros((5, size))
+        self.pos = np.zeros((5, size)) + np.arange(1, 6)[:, None]
+        # how far the middle markers' desired positions move with each sample
+        p = np.repeat(self.quantiles, n)
+        self.step = {1: p / 2, 2: p, 3: (1 + p) / 2}
+
+    def update(self, x: np.ndarray) -> None:
+        """
+        Add one sample of every value.
+        """
+        x = np.asarray(x, dtype="float64")
+        self.count += 1
+        if self.count <= 5:
+            self.first.append(x)
+            if self.count == 5:
+                first = np.sort(np.stack(self.first), axis=0)
+                self.heights[:] = np.tile(first, len(self.quantiles))
+                self.first = []
+            return
+
+        h, pos = self.heights, self.pos
+        x = np.tile(x, len(self.quantiles))
+        np.minimum(h[0], x, out=h[0])
+        np.maximum(h[4], x, out=h[4])
+        # the cell that x falls in, 0..3
+        k = (x >= h[1]).astype("int8") + (x >= h[2]) + (x >= h[3])
+        pos[1:] += np.arange(1, 5)[:, None] > k
+
+        # adjust the middle markers that are a position or more out,
+        # only working on the ones that move
+        for i in (1, 2, 3):
+            d = 1 + (self.count - 1) * self.step[i] - pos[i]
+            move = ((d >= 1) & (pos[i + 1] - pos[i] > 1)) | (
+                (d <= -1) & (pos[i - 1] - pos[i] < -1)
+            )
+            j = np.flatnonzero(move)
+            if len(j) == 0:
+                continue
+            s = np.sign(d[j])
+            hl, hi, hr = h[i - 1, j], h[i, j], h[i + 1, j]
+            below = pos[i, j] - pos[i - 1, j]
+            above = pos[i + 1, j] - pos[i, j]
+            parabolic = hi + s / (below + above) * (
+                (below + s) * (hr - hi) / above + (above - s) * (hi - hl) / below
+            )
+            linear = np.where(s > 0, hi + (hr - hi) / above, hi - (hi - hl) / below)
+            ok = (hl < parabolic) & (parabolic < hr)
+            h[i, j] = np.where(ok, parabolic, linear)
+            pos[i, j] += s
+
+    def result(self) -> np.ndarray:
+        """
+        Returns: the estimates, of shape (quantiles, values)
+        """
+        if self.count < 5:
+            # too few samples for the markers, so use them directly
+            return np.quantile(np.stack(self.first), self.quantiles, axis=0)
+        return self.heights[2].reshape(self.shape).copy()
+
+
+def run_montecarlo(
+    model: ModuleType,
+    data: Path,
+    out: Path,
+    pars: dict,
+    dists: dict,
+    samples: int = 1000,
+    quantiles: Sequence[float] = (0.05, 0.5, 0.95),
+    seed: int = None,
+    chunk_size: int = 100,
+    memory: float = 1024,
+) -> None:
+    """
+    Run a model many times with parameters sampled from distributions and
+    save quantiles of each numerical output for every hexagon.
+
+    Each sample is run over the hexagons on its own (with the model's
+    `model_batch` if it has one), as the models' `prepare` works on one set of
+    parameters at a time, and added to a `P2Quantiles` per output.
+    Their memory doesn't grow with the number of samples, but does with the
+    number of hexagons, so the hexagons are read as many at a time as fit in
+    `memory`, and every sample is run over them before reading the next ones.
+
+    Parameters
+    ----------
+    model: module
+        The model (see `spider.run.load_model`).
+    data: pathlib.Path
+        The hex file.
+    out: pathlib.Path
+        File to save to (.parquet, .arrow, .feather or .csv), with columns like
+        `profit_p5` and `profit_mean`.
+    pars: dict
+        Values for the parameters that aren't sampled.
+    dists: dict
+        Samplers from `get_distributions`.
+    samples: int, optional (default 1000)
+        Number of samples.
+    quantiles: list of float, optional (default 0.05, 0.5, 0.95)
+    seed: int, optional
+        Seed for the random numbers.
+    chunk_size: int, optional (default 100)
+        Number of samples to draw at a time.
+    memory: float, optional (default 1024)
+        Roughly how much memory (in MB) the hexagons being run can take up,
+        with their inputs, outputs and quantile estimates.
+    """
+    columns = None
+    if hasattr(model, "Town"):
+        columns = list(dict.fromkeys([*id_cols, *model.Town.__annotations__]))
+    first = next(iter_hex(data, columns, 1), None)
+    if first is None:
+        raise ValueError(f"No hexagons in {data}")
+    # every block of hexagons gets the same samples
+    seeds = np.random.SeedSequence(seed)
+    size = block_size(model, first, pars, dists, len(quantiles), memory, seeds)
+
+    done = 0
+    with table_writer(out) as write:
+        for df in iter_hex(data, columns, size):
+            echo(f"Running hexagons {done + 1:,} to {done + len(df):,}")
+            rng = np.random.default_rng(seeds)
+            write(
+                run_block(model, df, pars, dists, samples, quantiles, rng, chunk_size)
+            )
+            done += len(df)
+
+
+def run_sample(
+    model: ModuleType, df: pd.DataFrame, towns: dict, pars: dict
+) -> pd.DataFrame:
+    """Run one sample, using `towns` (the columns of `df`) for `model_batch`."""
+    if hasattr(model, "model_batch"):
+        return pd.DataFrame(model.model_batch(towns, pars))
+    return evaluate(model, df, pars)
+
+
+def block_size(
+    model: ModuleType,
+    first: pd.DataFrame,
+    pars: dict,
+    dists: dict,
+    n_quantiles: int,
+    memory: float,
+    seeds: np.random.SeedSequence,
+) -> int:
+    """
+    Get how many hexagons fit in `memory` (MB), from the model's outputs
+    for the first hexagon.
+    """
+    rng = np.random.default_rng(seeds)
+    pars = {**pars, **{k: draw(rng, 1)[0] for k, draw in dists.items()}}
+    res = run_sample(model, first, {k: first[k].to_numpy() for k in first}, pars)
+    numeric = sum(pd.api.types.is_numeric_dtype(res[c]) for c in res.columns)
+    # P2Quantiles keeps 14 floats per quantile (markers, positions, steps and
+    # the sample), plus the sample and the sum for the mean, for every output.
+    # The model's inputs and outputs are counted a few times over for the
+    # arrays it makes along the way.
+    per_hex = 8 * (
+        numeric * (14 * n_quantiles + 2) + 4 * (len(first.columns) + len(res.columns))
+    )
+    return max(1, int(memory * 2**20 // per_hex))
+
+
+def run_block(
+    model: ModuleType,
+    df: pd.DataFrame,
+    pars: dict,
+    dists: dict,
+    samples: int,
+    quantiles: Sequence[float],
+    rng: np.random.Generator,
+    chunk_size: int,
+) -> pd.DataFrame:
+    """
+    Run every sample over some hexagons.
+
+    Returns: the hexagons' `index` and `h3_index` and the quantiles and mean
+    of each numerical output
+    """
+    towns = {k: df[k].to_numpy() for k in df.columns}
+    sketches: dict = {}
+    means: dict = {}
+    start = time.perf_counter()
+    for first in range(0, samples, chunk_size):
+        size = min(chunk_size, samples - first)
+        drawn = {k: sample(rng, size) for k, sample in dists.items()}
+        for j in range(size):
+            sample = {**pars, **{k: v[j] for k, v in drawn.items()}}
+            res = run_sample(model, df, towns, sample)
+            for col in res.columns:
+                if not pd.api.types.is_numeric_dtype(res[col]):
+                    continue
+                if col not in sketches:
+                    sketches[col] = P2Quantiles(quantiles, len(df))
+                    means[col] = np.zeros(len(df))
+                x = res[col].to_numpy(dtype="float64")
+                sketches[col].update(x)
+                means[col] += x
+        done = first + size
+        rate = done / (time.perf_counter() - start)
+        echo(f"Done {done:,}/{samples:,} samples ({rate:,.1f} per second)")
+
+    result = df[[c for c in id_cols if c in df.columns]].reset_index(drop=True)
+    for col, sketch in sketches.items():
+        for q, est in zip(quantiles, sketch.result()):
+            result[f"{col}_p{q * 100:g}"] = est
+        result[f"{col}_mean"] = means[col] / samples
+    return result
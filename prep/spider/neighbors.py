@@ -1,26 +1,48 @@
+from itertools import chain
+
 import geopandas as gpd
+import h3
 import numpy as np
 import pandas as pd
+from h3.api import basic_int as h3_int
 
 
 def add_neighbors(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    """Geom should already be a hex geometry."""
-    orig_crs = gdf.crs
-    gdf = gdf.to_crs(epsg=3857)
-
-    nei = []
-    for idx, row in gdf.iterrows():
-        out = (
-            gpd.GeoDataFrame(geometry=[row.geometry], crs=gdf.crs)
-            .sjoin_nearest(gdf, how="left", max_distance=0.1)
-            .index_right
-        )
-        out = out.loc[out != idx]
-        out = np.pad(out, (0, 6 - len(out)))
-        nei.append(out)
+    """
+    Add n0..n5 columns with the index labels of each hexagon's neighbors.
+
+    Geom should already be a hex geometry with an `h3_index` column
+    (as assigned by `create_hex`).
+    Neighbors are looked up from the H3 grid directly, so this is linear in
+    the number of hexagons. H3 only finds the neighbors of one cell at a time,
+    so that is done on integer cells (much cheaper than strings), and the rest
+    (finding them among the hexagons and laying them out) on arrays.
+    Missing neighbors (pentagons and the edge of the AOI) are padded with 0
+    at the end of the row.
+    """
+    if "h3_index" not in gdf.columns:
+        raise ValueError("Need an 'h3_index' column to calculate neighbors.")
+
+    n = len(gdf)
+    cells = np.array([h3.str_to_int(c) for c in gdf["h3_index"]], dtype="uint64")
+    # grid_disk (unlike grid_ring) is safe around pentagons
+    disks = [h3_int.grid_disk(c, 1) for c in cells.tolist()]
+    sizes = np.fromiter(map(len, disks), dtype="int64", count=n)
+    disk = np.fromiter(chain.from_iterable(disks), dtype="uint64", count=sizes.sum())
+    row = np.repeat(np.arange(n), sizes)
+
+    # find each neighbor among the sorted cells
+    order = np.argsort(cells, kind="stable")
+    ordered = cells[order]
+    at = np.minimum(np.searchsorted(ordered, disk), max(n - 1, 0))
+    found = (ordered[at] == disk) & (disk != cells[row])
+    row, pos = row[found], order[at[found]]
 
+    # put the ones found first in each row, keeping H3 order
+    col = np.arange(len(row)) - np.searchsorted(row, np.arange(n))[row]
+    labels = gdf.index.to_numpy()
+    nei = np.zeros((n, 6), dtype="int64")
+    nei[row, col] = labels[pos]
     nei = pd.DataFrame(nei, columns=[f"n{i}" for i in range(6)], index=gdf.index)
 
-    gdf = pd.concat((gdf, nei), axis=1)
-    gdf = gdf.to_crs(orig_crs)
-    return gdf
+    return pd.concat((gdf, nei), axis=1)
@@ -0,0 +1,101 @@
+"""
+Things that the features in one `add_features` run can share:
+the hexagons reprojected to each CRS, and open raster datasets.
+
+Inside `shared()`, `to_crs` reprojects the hexagons only once per CRS and
+`dataset` keeps rasters open for the next feature that reads them.
+Outside it, they just reproject and open/close as usual.
+"""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+import geopandas as gpd
+import rasterio
+from pyproj import CRS
+
+from spider import report
+
+
+class Pool:
+    """
+    Projected hexagons (by CRS) and open datasets (by path).
+    """
+
+    def __init__(self) -> None:
+        self.geoms: dict = {}
+        self.datasets: dict = {}
+
+    def to_crs(self, geom: gpd.GeoDataFrame, crs: Union[CRS, str]) -> gpd.GeoDataFrame:
+        # keyed by the hexagons object too, which is kept so its id isn't reused
+        key = (id(geom), CRS.from_user_input(crs).to_wkt())
+        if key not in self.geoms or self.geoms[key][0] is not geom:
+            with report.stage("reproject"):
+                self.geoms[key] = (geom, geom.to_crs(crs))
+        return self.geoms[key][1]
+
+    def open(self, path: Path, **kwargs: object) -> rasterio.DatasetReader:
+        key = (str(Path(path).resolve()), *sorted(kwargs.items()))
+        if key not in self.datasets or self.datasets[key].closed:
+            self.datasets[key] = rasterio.open(path, **kwargs)
+        return self.datasets[key]
+
+    def close(self) -> None:
+        for ds in self.datasets.values():
+            ds.close()
+        self.datasets.clear()
+        self.geoms.clear()
+
+
+_pool: Optional[Pool] = None
+
+
+@contextmanager
+def shared() -> Iterator[Pool]:
+    """
+    Share reprojected hexagons and open datasets until the block finishes,
+    when the datasets are closed.
+    """
+    global _pool
+    outer, _pool = _pool, Pool()
+    try:
+        yield _pool
+    finally:
+        pool, _pool = _pool, outer
+        pool.close()
+
+
+def start() -> Pool:
+    """
+    Share for the rest of this process (eg in a worker process, where
+    the datasets are closed when it exits).
+    """
+    global _pool
+    _pool = Pool()
+    return _pool
+
+
+def to_crs(geom: gpd.GeoDataFrame, crs: Union[CRS, str]) -> gpd.GeoDataFrame:
+    """
+    Reproject the hexagons, reusing an earlier result for the same CRS if shared,
+    so the result mustn't be changed in place.
+    """
+    if _pool is None:
+        with report.stage("reproject"):
+            return geom.to_crs(crs)
+    return _pool.to_crs(geom, crs)
+
+
+@contextmanager
+def dataset(path: Path, **kwargs: object) -> Iterator[rasterio.DatasetReader]:
+    """
+    Open a raster (passing `kwargs` to `rasterio.open`, eg `overview_level`),
+    leaving it open for reuse if shared.
+    """
+    if _pool is not None:
+        yield _pool.open(path, **kwargs)
+        return
+    with rasterio.open(path, **kwargs) as ds:
+        yield ds
@@ -0,0 +1,121 @@
+"""
+Spread drawn infrastructure outwards over the hexagon neighbor graph.
+
+This only depends on NumPy, as it is also loaded by the web app (in Pyodide)
+from frontend/dist/models/propagate.py, which must be an exact copy of this
+file (tests/test_propagate.py checks it).
+"""
+
+from typing import Optional
+
+import numpy as np
+
+
+def build_adjacency(
+    neighbors: np.ndarray, labels: Optional[np.ndarray] = None
+) -> tuple:
+    """
+    Build a CSR adjacency between rows from the n0..n5 neighbor columns.
+
+    Only pairs of hexagons that list each other are kept, which drops the 0
+    that `add_neighbors` pads missing neighbors with.
+
+    Parameters
+    ----------
+    neighbors: numpy.ndarray
+        Array of shape (rows, 6) with the label of each row's neighbors.
+    labels: numpy.ndarray, optional
+        The label of each row (the `index` column). Defaults to the row number.
+
+    Returns: (indptr, indices), so the neighbors of row i are
+    indices[indptr[i]:indptr[i + 1]]
+    """
+    neighbors = np.asarray(neighbors, dtype="int64")
+    n = len(neighbors)
+    labels = np.arange(n) if labels is None else np.asarray(labels, dtype="int64")
+
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    flat = neighbors.ravel()
+    pos = np.clip(np.searchsorted(sorted_labels, flat), 0, max(n - 1, 0))
+    found = sorted_labels[pos] == flat if n > 0 else np.zeros(0, dtype=bool)
+
+    src = np.repeat(np.arange(n), neighbors.shape[1])[found]
+    dst = order[pos[found]]
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+
+    pairs = unique(src * n + dst)
+    reverse = (pairs % n) * n + pairs // n
+    pos = np.clip(np.searchsorted(pairs, reverse), 0, max(len(pairs) - 1, 0))
+    pairs = pairs[pairs[pos] == reverse] if len(pairs) > 0 else pairs
+    src, dst = np.divmod(pairs, n)
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n))))
+    return indptr, dst
+
+
+def unique(arr: np.ndarray) -> np.ndarray:
+    """
+    Sorted unique values of an integer array
+    (faster than `np.unique` for large, spread out integers like these).
+    """
+    arr = np.sort(arr)
+    if len(arr) == 0:
+        return arr
+    return arr[np.concatenate(([True], arr[1:] != arr[:-1]))]
+
+
+def neighbors_of(
+    rows: np.ndarray, indptr: np.ndarray, indices: np.ndarray
+) -> np.ndarray:
+    """
+    Get all the neighbors of some rows (with duplicates).
+    """
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return indices[np.repeat(starts, counts) + offsets]
+
+
+def propagate(
+    values: np.ndarray,
+    sources: np.ndarray,
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    step: float,
+) -> np.ndarray:
+    """
+    Set the hexagons under a drawing to 0 and spread outwards one ring at a
+    time, adding `step` per ring, wherever that lowers the existing value.
+
+    This is a level-synchronous breadth-first search from all the sources at
+    once: each ring is a single set of NumPy operations, and it only carries on
+    from hexagons whose values were lowered.
+
+    Parameters
+    ----------
+    values: numpy.ndarray
+        Values (eg `grid_dist`) for every row, updated in place.
+    sources: numpy.ndarray
+        Rows under the drawing.
+    indptr, indices: numpy.ndarray
+        Adjacency from `build_adjacency`.
+    step: float
+        Amount to add for each ring of hexagons (eg the hexagon size in km).
+
+    Returns: the rows whose values were changed
+    """
+    frontier = unique(np.asarray(sources, dtype="int64"))
+    dist = 0.0
+    changed = []
+    while len(frontier) > 0:
+        frontier = frontier[values[frontier] > dist]
+        if len(frontier) == 0:
+            break
+        values[frontier] = dist
+        changed.append(frontier)
+        frontier = unique(neighbors_of(frontier, indptr, indices))
+        dist += step
+    if not changed:
+        return np.zeros(0, dtype="int64")
+    return unique(np.concatenate(changed))
@@ -0,0 +1,179 @@
+"""
+Coarser hex levels made from the finest one, by adding up (or averaging etc)
+each feature over the children of every H3 parent cell, rather than
+calculating every feature again at each resolution.
+"""
+
+from pathlib import Path
+from typing import Optional
+
+import geopandas as gpd
+import h3
+import numpy as np
+import pandas as pd
+
+from spider.features import cells_to_hex, finish_feature
+from spider.neighbors import add_neighbors
+
+# How each feature's raw values are combined over the children of a parent
+aggregations = {
+    "sum": "sum",
+    "count": "sum",
+    "mean": "mean",
+    "max": "max",
+    "min": "min",
+    "distance": "min",
+    "sjoin": "majority",
+}
+
+
+def check_levels(levels: list, hex_res: int) -> list:
+    """
+    Returns: the `pyramid` resolutions, finest first
+    """
+    levels = sorted({int(r) for r in levels or []}, reverse=True)
+    for res in levels:
+        if not 0 <= res < hex_res:
+            raise ValueError(f"pyramid resolutions must be from 0 to {hex_res - 1}")
+    return levels
+
+
+def weight_name(f: dict) -> str:
+    return f"_{f['name']}_pixels"
+
+
+def weight_features(features: list) -> list:
+    """
+    Get the extra features needed to weight means by their number of pixels:
+    a 'count' of the same raster for every raster 'mean'.
+    Their names start with '_', and they aren't saved.
+    """
+    return [
+        {
+            **{k: v for k, v in f.items() if k not in ("decimals", "fix")},
+            "name": weight_name(f),
+            "operation": "count",
+        }
+        for f in features
+        if f["type"] == "raster" and f["operation"] == "mean"
+    ]
+
+
+def level_path(file: Path, res: int) -> Path:
+    """eg hex.parquet -> hex_res5.parquet"""
+    return file.with_name(f"{file.stem}_res{res}{file.suffix}")
+
+
+def missing_raw(geom: gpd.GeoDataFrame, raw: dict, features: list) -> list:
+    """
+    Returns: the features (and pixel counts for means) that the levels need the
+    raw values of but don't have them, eg columns that were already in the file
+    with `--append --no-reuse`. Features that failed (not in `geom`) are left out.
+    """
+    missing = []
+    for f in features:
+        name = f["name"]
+        if name not in raw:
+            if name in geom.columns:
+                missing.append(name)
+        elif aggregations.get(f["operation"]) == "mean" and weight_name(f) not in raw:
+            missing.append(weight_name(f))
+    return missing
+
+
+def aggregate(
+    values: np.ndarray,
+    parent: np.ndarray,
+    n: int,
+    how: str,
+    weight: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Combine values over the children of each parent, ignoring missing values.
+
+    Parameters
+    ----------
+    values: numpy.ndarray
+        A value for each child.
+    parent: numpy.ndarray
+        The position (0 to n - 1) of each child's parent.
+    n: int
+        Number of parents.
+    how: str
+        'sum', 'mean', 'max', 'min' or 'majority' (the most common value).
+    weight: numpy.ndarray, optional
+        Only for 'mean': how much each child counts (eg its number of pixels).
+
+    Returns: array with a value for each parent, NaN where none of its
+    children have one
+    """
+    vals = pd.Series(values)
+    if how == "mean":
+        valid = vals.notna().to_numpy()
+        w = np.ones(len(vals)) if weight is None else np.nan_to_num(weight)
+        w = np.where(valid, w, 0)
+        x = np.where(valid, vals.to_numpy(dtype="float64", na_value=0), 0)
+        total = np.bincount(parent, weights=x * w, minlength=n)
+        w_total = np.bincount(parent, weights=w, minlength=n)
+        out = np.full(n, np.nan)
+        has = w_total > 0
+        out[has] = total[has] / w_total[has]
+        return out
+
+    groups = vals.groupby(parent)
+    if how == "sum":
+        out = groups.sum(min_count=1)
+    elif how in ("max", "min"):
+        out = groups.agg(how)
+    elif how == "majority":
+        counts = vals.groupby([parent, vals]).size()
+        counts = counts.sort_values(ascending=False, kind="stable")
+        top = counts[~counts.index.get_level_values(0).duplicated()].index
+        out = pd.Series(top.get_level_values(1), index=top.get_level_values(0))
+    else:
+        raise ValueError(f"Aggregation must be one of {set(aggregations.values())}")
+    return out.reindex(range(n)).to_numpy()
+
+
+def make_level(
+    geom: gpd.GeoDataFrame, raw: dict, features: list, res: int
+) -> gpd.GeoDataFrame:
+    """
+    Make a coarser level from the finest hexagons.
+
+    Parameters
+    ----------
+    geom: geopandas.GeoDataFrame
+        The finest hexagons, with an `h3_index` column and the features.
+    raw: dict
+        Each feature's values before `decimals` and `fix`, and the pixel counts
+        for means (see `weight_features`). Features that aren't in here or in
+        `geom` failed, and are left out.
+    features: list
+        The features from the config.
+    res: int
+        The H3 resolution to make.
+
+    Returns: the hexagons (every parent of the finest ones) with neighbors
+    and the features (except any missing from the finest), with `decimals`
+    and `fix` applied again
+    """
+    missing = missing_raw(geom, raw, features)
+    if missing:
+        raise ValueError(f"No raw values to aggregate for: {', '.join(missing)}")
+    parents = np.array([h3.cell_to_parent(c, res) for c in geom["h3_index"]])
+    level = add_neighbors(cells_to_hex(set(parents)))
+    pos = pd.Index(level["h3_index"]).get_indexer(parents)
+
+    for f in features:
+        name = f["name"]
+        if name not in raw:
+            continue  # it failed
+        how = aggregations.get(f["operation"])
+        if how is None:
+            raise ValueError(f"Can't aggregate operation '{f['operation']}'")
+        values = raw[name]
+        weight = raw.get(weight_name(f)) if how == "mean" else None
+        level[name] = aggregate(values, pos, len(level), how, weight)
+        level[name] = finish_feature(level, f)
+    return level
@@ -0,0 +1,149 @@
+"""
+Record where the time and memory go in a `spi` run.
+
+A `record` collects the wall time, CPU time and peak memory of a run or of one
+feature, and of the `stage`s within it (eg read, reproject, rasterize), along
+with the input sizes passed to `count`. Stages and counts outside a record
+cost next to nothing, so they can be left in the code.
+"""
+
+import cProfile
+import csv
+import json
+import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+# the records being made, innermost last
+_active: list = []
+
+
+def peak_rss() -> Optional[float]:
+    """
+    Returns: the peak memory (resident set size) of this process so far in MB,
+    or None where it isn't available (Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def usage() -> tuple:
+    return time.perf_counter(), time.process_time(), peak_rss()
+
+
+def since(start: tuple) -> dict:
+    """
+    Returns: the time and memory used since `start` (from `usage`)
+    """
+    wall, cpu, rss = usage()
+    return {
+        "wall_s": wall - start[0],
+        "cpu_s": cpu - start[1],
+        "peak_rss_mb": rss,
+        # how much this raised the process's peak memory
+        "rss_added_mb": None if rss is None else rss - start[2],
+    }
+
+
+@contextmanager
+def record(name: str, profile_dir: Optional[Path] = None) -> Iterator[dict]:
+    """
+    Record the stages and input sizes of a run or a feature.
+
+    Parameters
+    ----------
+    name: str
+    profile_dir: pathlib.Path, optional
+        Directory to save a cProfile dump to, as {name}.prof
+        (open it with eg `python -m pstats` or snakeviz).
+
+    Yields: the record, which is filled in when the block finishes
+    """
+    rec: dict = {"name": name, "stages": {}, "sizes": {}}
+    profiler = cProfile.Profile() if profile_dir is not None else None
+    _active.append(rec)
+    start = usage()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield rec
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            Path(profile_dir).mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(Path(profile_dir) / f"{name}.prof")
+        rec.update(since(start))
+        _active.remove(rec)
+
+
+@contextmanager
+def stage(name: str, rec: Optional[dict] = None) -> Iterator[None]:
+    """
+    Time a stage within the innermost record (or `rec`).
+    Stages that happen more than once are added up.
+    """
+    rec = rec if rec is not None else (_active[-1] if _active else None)
+    if rec is None:
+        yield
+        return
+    start = usage()
+    try:
+        yield
+    finally:
+        used = since(start)
+        old = rec["stages"].get(name)
+        if old is None:
+            rec["stages"][name] = {**used, "calls": 1}
+        else:
+            old["wall_s"] += used["wall_s"]
+            old["cpu_s"] += used["cpu_s"]
+            old["peak_rss_mb"] = used["peak_rss_mb"]
+            if used["rss_added_mb"] is not None:
+                old["rss_added_mb"] += used["rss_added_mb"]
+            old["calls"] += 1
+
+
+def count(**sizes: int) -> None:
+    """
+    Add to the input sizes of the innermost record,
+    eg `count(raster_pixels=arr.size)`.
+    """
+    if _active:
+        rec_sizes = _active[-1]["sizes"]
+        for k, v in sizes.items():
+            rec_sizes[k] = rec_sizes.get(k, 0) + int(v)
+
+
+def save_report(report: dict, out: Path) -> None:
+    """
+    Save a run's record, with its features' records under "features",
+    as JSON, or as CSV with a row for each run/feature and stage.
+    """
+    out = Path(out)
+    if out.suffix == ".json":
+        with out.open("w") as f:
+            json.dump(report, f, indent=2)
+        return
+    if out.suffix != ".csv":
+        raise ValueError("Report must be .json or .csv")
+
+    rows = []
+    for rec in [report, *report.get("features", [])]:
+        keys = ("wall_s", "cpu_s", "peak_rss_mb", "rss_added_mb")
+        totals = {k: rec.get(k) for k in keys}
+        rows.append({"name": rec["name"], "stage": "", **totals, **rec["sizes"]})
+        for name, used in rec["stages"].items():
+            rows.append({"name": rec["name"], "stage": name, **used, **rec["sizes"]})
+    fields = list(dict.fromkeys(k for row in rows for k in row))
+    with out.open("w", newline="") as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,113 @@
+import importlib.util
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Optional, Union
+
+import pandas as pd
+import yaml
+from typer import echo
+
+from spider.formats import iter_hex, table_writer
+
+# Columns to copy to the output to identify each hexagon
+id_cols = ("index", "h3_index")
+
+
+def load_app_config(config: Path) -> tuple:
+    """
+    Load an app config (eg frontend/dist/config/fish.yml).
+
+    Returns: the config, and the app directory that its `model` and `data`
+    paths are relative to (the one with index.html)
+    """
+    config = Path(config).resolve()
+    with config.open() as f:
+        cfg = yaml.safe_load(f)
+    return cfg, config.parents[1]
+
+
+def load_model(path: Path) -> ModuleType:
+    """
+    Import a model file (eg frontend/dist/models/fish.py).
+    """
+    spec = importlib.util.spec_from_file_location(Path(path).stem, path)
+    if spec is None or spec.loader is None:
+        raise ValueError(f"Can't load a model from {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_pars(cfg: dict, overrides: Optional[list] = None) -> dict:
+    """
+    Get the default `pars` from an app config, with some changed.
+
+    Parameters
+    ----------
+    cfg: dict
+        The app config.
+    overrides: list of str, optional
+        Values to change, as 'name=value'.
+    """
+    pars = {p["col"]: to_number(p["val"]) for p in cfg["pars"]}
+    for o in overrides or []:
+        name, sep, val = o.partition("=")
+        if not sep or name not in pars:
+            raise ValueError(
+                f"Parameters must be 'name=value', with a name from: {', '.join(pars)}"
+            )
+        pars[name] = to_number(val)
+    return pars
+
+
+def to_number(val: Union[str, float]) -> Union[str, float]:
+    """
+    Convert to a number if possible (as the app does with its parameters).
+    """
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return val
+
+
+def evaluate(model: ModuleType, df: pd.DataFrame, pars: dict) -> pd.DataFrame:
+    """
+    Run a model on a DataFrame of hexagons,
+    using its `model_batch` if it has one, or else `model` on each row.
+    """
+    if hasattr(model, "model_batch"):
+        towns = {k: df[k].to_numpy() for k in df.columns}
+        return pd.DataFrame(model.model_batch(towns, pars), index=df.index)
+    rows = [model.model(town, pars) for town in df.to_dict("records")]
+    return pd.DataFrame(rows, index=df.index)
+
+
+def run_model(
+    model: ModuleType,
+    data: Path,
+    out: Path,
+    pars: dict,
+    chunk_size: int = 100_000,
+) -> int:
+    """
+    Run a model over a hex file and save the results, a chunk at a time,
+    so memory use depends on `chunk_size` rather than the number of hexagons.
+
+    Returns: the number of hexagons
+    """
+    columns = None
+    if hasattr(model, "Town"):
+        columns = list(dict.fromkeys([*id_cols, *model.Town.__annotations__]))
+
+    start = time.perf_counter()
+    done = 0
+    with table_writer(out) as write:
+        for df in iter_hex(data, columns, chunk_size):
+            res = evaluate(model, df, pars)
+            ids = df[[c for c in id_cols if c in df.columns]]
+            write(pd.concat((ids, res), axis=1))
+            done += len(df)
+            rate = done / (time.perf_counter() - start)
+            echo(f"Done {done:,} hexagons ({rate:,.0f} per second)")
+    return done
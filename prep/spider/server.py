@@ -0,0 +1,279 @@
+"""
+Run app models on a local server, for browsers too slow to run them in Pyodide.
+
+It only uses the standard library's asyncio, and speaks just enough HTTP for
+the app's `getModel` (see frontend/dist/funcs.js):
+
+POST /{name}/run  {"pars": {...}, "edits": {col: {row: value}}}
+    Returns every hexagon's results, as typed-array buffers (see `encode`).
+POST /{name}/draw  {"col": ..., "rows": [...], "step": ..., "edits": {...}}
+    Returns the {"rows": [...], "values": [...]} changed by a drawing.
+
+`edits` are the hexagon properties that drawing has changed from the data.
+"""
+
+import asyncio
+import json
+import time
+import traceback
+from collections import OrderedDict
+from http import HTTPStatus
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from typer import echo
+
+from spider.formats import iter_hex
+from spider.propagate import build_adjacency, propagate
+from spider.run import evaluate, get_pars, load_model, to_number
+
+
+class ResultCache:
+    """
+    Least recently used cache of responses, limited by their total size.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.items: OrderedDict = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        if key not in self.items:
+            return None
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        if key in self.items:
+            self.nbytes -= len(self.items.pop(key))
+        self.items[key] = value
+        self.nbytes += len(value)
+        while self.nbytes > self.max_bytes:
+            _, old = self.items.popitem(last=False)
+            self.nbytes -= len(old)
+
+
+class AppModel:
+    """
+    An app's model and hexagons, loaded once, with a cache of results.
+
+    Parameters
+    ----------
+    cfg: dict
+        The app config.
+    app_dir: pathlib.Path
+        The directory its `model` and `data` paths are relative to.
+    cache_bytes: int, optional (default 256 MB)
+        Size limit for the cached results.
+    """
+
+    def __init__(
+        self, cfg: dict, app_dir: Path, cache_bytes: int = 256 * 2**20
+    ) -> None:
+        self.cfg = cfg
+        self.model = load_model(app_dir / cfg["model"])
+        df = pd.concat(list(iter_hex(app_dir / cfg["data"])), ignore_index=True)
+        self.towns = {k: df[k].to_numpy() for k in df.columns}
+        self.cache = ResultCache(cache_bytes)
+        self.running: dict = {}
+        self.adjacency: Optional[tuple] = None
+
+    def normalize(self, pars: dict, edits: dict) -> tuple:
+        """
+        Fill in the defaults, and get a key that is the same for the same
+        request, however it was written (eg 5 or "5.0", or keys in any order).
+        """
+        pars = {**get_pars(self.cfg), **{k: to_number(v) for k, v in pars.items()}}
+        unknown = set(pars) - {p["col"] for p in self.cfg["pars"]}
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+        edits = {
+            col: dict(sorted((int(r), to_number(v)) for r, v in rows.items()))
+            for col, rows in sorted(edits.items())
+            if rows
+        }
+        unknown = set(edits) - set(self.towns)
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+        key = json.dumps([sorted(pars.items()), list(edits.items())])
+        return key, pars, edits
+
+    def with_edits(self, edits: dict) -> dict:
+        """
+        Returns: the hexagon columns with `edits` applied (copying only those)
+        """
+        towns = dict(self.towns)
+        for col, rows in edits.items():
+            values = towns[col].astype("float64")
+            values[list(rows)] = list(rows.values())
+            towns[col] = values
+        return towns
+
+    def evaluate(self, pars: dict, edits: dict) -> bytes:
+        towns = self.with_edits(edits)
+        if hasattr(self.model, "model_batch"):
+            res = self.model.model_batch(towns, pars)
+        else:
+            res = evaluate(self.model, pd.DataFrame(towns), pars)
+        return encode(res)
+
+    async def run(self, pars: dict, edits: dict) -> tuple:
+        """
+        Get the results for `pars`: from the cache, by waiting on an identical
+        request that is already running, or else by running the model
+        (in a thread, so other requests can still be answered).
+        A run is forgotten as soon as it finishes, even if it failed, and isn't
+        cancelled if the request that started it goes away.
+
+        Returns: the encoded results, and how they were got
+        """
+        key, pars, edits = self.normalize(pars, edits)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, "cached"
+        if key in self.running:
+            return await asyncio.shield(self.running[key]), "coalesced"
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, self.evaluate, pars, edits)
+        self.running[key] = future
+        future.add_done_callback(lambda f: self.finished(key, f))
+        return await asyncio.shield(future), "ran"
+
+    def finished(self, key: str, future: asyncio.Future) -> None:
+        del self.running[key]
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(key, future.result())
+
+    def draw(self, col: str, rows: list, step: float, edits: dict) -> dict:
+        """
+        Set a column to 0 under a drawing and spread it outwards
+        (see `spider.propagate`).
+        """
+        if col not in self.towns:
+            raise ValueError(f"Unknown column: {col}")
+        _, _, edits = self.normalize({}, edits)
+        if self.adjacency is None:
+            neighbors = np.column_stack([self.towns[f"n{i}"] for i in range(6)])
+            self.adjacency = build_adjacency(neighbors, self.towns.get("index"))
+        values = self.with_edits(edits)[col].astype("float64")
+        changed = propagate(values, np.asarray(rows), *self.adjacency, float(step))
+        return {"rows": changed.tolist(), "values": values[changed].tolist()}
+
+
+def encode(res: dict) -> bytes:
+    """
+    Encode result columns compactly for the browser to read without parsing:
+    a 4-byte (little-endian) header length, a JSON header (padded so the
+    buffers start at a multiple of 8 bytes), and then each column's buffer.
+
+    Numerical columns are float64. Others (eg `tech`) are int32 codes into
+    a list of `cats` in the header, with -1 for missing values.
+    """
+    columns, buffers, offset, n = [], [], 0, 0
+    for name, values in res.items():
+        values = np.asarray(values)
+        n = len(values)
+        col = {"name": name, "offset": offset}
+        if values.dtype.kind in "biuf":
+            buf = values.astype("<f8").tobytes()
+            col["type"] = "float64"
+        else:
+            codes, cats = pd.factorize(values)
+            buf = codes.astype("<i4").tobytes()
+            buf += bytes(-len(buf) % 8)
+            col["type"] = "int32"
+            col["cats"] = [str(c) for c in cats]
+        columns.append(col)
+        buffers.append(buf)
+        offset += len(buf)
+
+    header = json.dumps({"n": n, "columns": columns}).encode()
+    header += b" " * (-(4 + len(header)) % 8)
+    return len(header).to_bytes(4, "little") + header + b"".join(buffers)
+
+
+async def handle(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, apps: dict
+) -> None:
+    """
+    Answer the requests on one connection.
+    """
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            line, *lines = head.decode("latin-1").split("\r\n")
+            method, path, _ = line.split(" ", 2)
+            headers = dict(
+                (k.strip().lower(), v.strip())
+                for k, _, v in (h.partition(":") for h in lines if h)
+            )
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            status, content_type, content = await respond(method, path, body, apps)
+            writer.write(
+                (
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    "Access-Control-Allow-Origin: *\r\n"
+                    "Access-Control-Allow-Methods: POST, OPTIONS\r\n"
+                    "Access-Control-Allow-Headers: Content-Type\r\n"
+                    "\r\n"
+                ).encode()
+                + content
+            )
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    finally:
+        writer.close()
+
+
+async def respond(method: str, path: str, body: bytes, apps: dict) -> tuple:
+    """
+    Returns: the status, content type and content for a request
+    """
+    if method == "OPTIONS":
+        return HTTPStatus.NO_CONTENT, "text/plain", b""
+    name, _, action = path.strip("/").partition("/")
+    if method != "POST" or name not in apps or action not in ("run", "draw"):
+        return HTTPStatus.NOT_FOUND, "text/plain", b"Not found"
+
+    app = apps[name]
+    start = time.perf_counter()
+    try:
+        req = json.loads(body or b"{}")
+        if action == "run":
+            content, how = await app.run(req.get("pars", {}), req.get("edits", {}))
+            content_type = "application/octet-stream"
+        else:
+            args = (req["col"], req["rows"], req["step"], req.get("edits", {}))
+            content = json.dumps(app.draw(*args)).encode()
+            content_type, how = "application/json", "ran"
+    except (ValueError, KeyError, TypeError) as e:
+        return error(HTTPStatus.BAD_REQUEST, str(e))
+    except Exception as e:
+        echo(f"{name} {action}: failed\n{traceback.format_exc()}", err=True)
+        return error(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}")
+    ms = (time.perf_counter() - start) * 1000
+    echo(f"{name} {action}: {how} in {ms:.0f}ms ({len(content):,} bytes)")
+    return HTTPStatus.OK, content_type, content
+
+
+def error(status: HTTPStatus, message: str) -> tuple:
+    return status, "application/json", json.dumps({"error": message}).encode()
+
+
+async def serve(apps: dict, host: str = "127.0.0.1", port: int = 8000) -> None:
+    server = await asyncio.start_server(lambda r, w: handle(r, w, apps), host, port)
+    echo(f"Serving {', '.join(apps)} on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,194 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from typer import echo
+
+from spider.formats import iter_hex, table_writer
+from spider.run import evaluate, id_cols, load_model, to_number
+
+
+def get_scenarios(cfg: dict, pars: dict, vary: list, steps: int = 5) -> list:
+    """
+    Make every combination of the parameters being varied.
+
+    Parameters
+    ----------
+    cfg: dict
+        The app config.
+    pars: dict
+        Values for the parameters that aren't varied (see `spider.run.get_pars`).
+    vary: list of str
+        Parameters to vary: either just a name, to use `steps` values from its
+        slider's min to max (or every category), or 'name=a,b,c' for a list.
+    steps: int, optional (default 5)
+        Number of values for parameters without a list.
+
+    Returns: a list of `pars` dicts
+    """
+    sliders = {p["col"]: p for p in cfg["pars"]}
+    values = {}
+    for v in vary:
+        name, sep, vals = v.partition("=")
+        if name not in sliders:
+            raise ValueError(
+                f"Can't vary '{name}', must be one of: {', '.join(sliders)}"
+            )
+        if sep:
+            values[name] = [to_number(x) for x in vals.split(",")]
+        elif "cats" in sliders[name]:
+            values[name] = list(sliders[name]["cats"])
+        else:
+            s = sliders[name]
+            values[name] = np.linspace(s["min"], s["max"], steps).tolist()
+
+    return [
+        {**pars, **dict(zip(values, combo))}
+        for combo in itertools.product(*values.values())
+    ]
+
+
+def share(df: pd.DataFrame) -> tuple:
+    """
+    Copy the columns of a DataFrame into shared memory.
+
+    Returns: the SharedMemory blocks (to close and unlink when done), and a spec
+    of (name, block name, dtype, length) for `attach` to use in other processes
+    """
+    blocks, spec = [], []
+    for col in df.columns:
+        arr = df[col].to_numpy()
+        if arr.dtype == object:
+            arr = arr.astype(str)
+        shm = SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[:] = arr
+        blocks.append(shm)
+        spec.append((col, shm.name, arr.dtype.str, len(arr)))
+    return blocks, spec
+
+
+def attach(spec: list) -> tuple:
+    """
+    Get the columns shared by `share`, without copying them.
+
+    Returns: the SharedMemory blocks (to keep open), and the columns
+    """
+    blocks, columns = [], {}
+    for col, name, dtype, length in spec:
+        shm = SharedMemory(name=name)
+        blocks.append(shm)
+        columns[col] = np.ndarray((length,), np.dtype(dtype), buffer=shm.buf)
+    return blocks, columns
+
+
+_worker = {}
+
+
+def init_worker(model_path: Path, spec: list) -> None:
+    _worker["model"] = load_model(model_path)
+    _worker["blocks"], _worker["columns"] = attach(spec)
+
+
+def run_scenario(i: int, pars: dict, full: bool) -> tuple:
+    model, columns = _worker["model"], _worker["columns"]
+    if hasattr(model, "model_batch"):
+        # use the shared columns directly rather than copying them into a DataFrame
+        res = pd.DataFrame(model.model_batch(columns, pars))
+    else:
+        res = evaluate(model, pd.DataFrame(columns), pars)
+    return i, summarise(res), res if full else None
+
+
+def summarise(res: pd.DataFrame) -> dict:
+    """
+    Summarise a scenario's results: the sum and mean of each numerical output,
+    and the number of hexagons with each value of the others (eg `tech`).
+    """
+    summary = {}
+    for col in res.columns:
+        if pd.api.types.is_numeric_dtype(res[col]):
+            summary[f"{col}_sum"] = res[col].sum()
+            summary[f"{col}_mean"] = res[col].mean()
+        else:
+            for val, count in res[col].value_counts().items():
+                summary[f"{col}_{val}"] = count
+    return summary
+
+
+def run_sweep(
+    model_path: Path,
+    data: Path,
+    out: Path,
+    scenarios: list,
+    jobs: int = 1,
+    matrix: Optional[Path] = None,
+) -> pd.DataFrame:
+    """
+    Run a model for every scenario in a process pool, with the hexagons
+    loaded once into shared memory, and save a summary row per scenario.
+
+    Parameters
+    ----------
+    model_path: pathlib.Path
+        The model file.
+    data: pathlib.Path
+        The hex file.
+    out: pathlib.Path
+        File to save the summaries to (.parquet, .arrow, .feather or .csv).
+    scenarios: list of dict
+        The `pars` for each scenario (see `get_scenarios`).
+    jobs: int, optional (default 1)
+        Number of processes.
+    matrix: pathlib.Path, optional
+        File to also save every hexagon's results to, with a `scenario` column.
+    """
+    model = load_model(model_path)
+    columns = None
+    if hasattr(model, "Town"):
+        columns = list(dict.fromkeys([*id_cols, *model.Town.__annotations__]))
+    df = pd.concat(list(iter_hex(data, columns)), ignore_index=True)
+    ids = df[[c for c in id_cols if c in df.columns]]
+
+    varied = [k for k in scenarios[0] if len({str(s[k]) for s in scenarios}) > 1]
+    summaries = [None] * len(scenarios)
+    blocks, spec = share(df)
+    del df
+    try:
+        with ExitStack() as stack:
+            pool = stack.enter_context(
+                ProcessPoolExecutor(
+                    jobs, initializer=init_worker, initargs=(model_path, spec)
+                )
+            )
+            write = stack.enter_context(table_writer(matrix)) if matrix else None
+            futures = [
+                pool.submit(run_scenario, i, pars, matrix is not None)
+                for i, pars in enumerate(scenarios)
+            ]
+            for done, future in enumerate(as_completed(futures), start=1):
+                i, summary, res = future.result()
+                summaries[i] = {
+                    "scenario": i,
+                    **{k: scenarios[i][k] for k in varied},
+                    **summary,
+                }
+                if write is not None:
+                    write(pd.concat((ids.assign(scenario=i), res), axis=1))
+                echo(f"Done {done}/{len(scenarios)} scenarios")
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    summary = pd.DataFrame(summaries)
+    # categories that don't come up in a scenario have no count
+    counts = summary.columns.difference(["scenario", *varied])
+    summary[counts] = summary[counts].fillna(0)
+    with table_writer(out) as write:
+        write(summary)
+    return summary
@@ -0,0 +1,101 @@
+"""
+Split the hexagons into tiles (one GeoJSON per coarser H3 cell) with a small
+manifest, so the app only has to load and run the tiles in view.
+"""
+
+import json
+from collections.abc import Sequence
+from pathlib import Path
+
+import geopandas as gpd
+import h3
+import numpy as np
+import pandas as pd
+
+from spider.formats import write_geojson
+
+
+def write_tiles(
+    geom: gpd.GeoDataFrame,
+    folder: Path,
+    tile_res: int,
+    decimals: dict = None,
+    coord_decimals: int = 6,
+    compress: Sequence[str] = (),
+) -> dict:
+    """
+    Save a GeoJSON of the hexagons in each H3 cell at `tile_res`, and a
+    manifest.json with each tile's bounds and number of hexagons, and the
+    minimum and maximum of each numeric column over every hexagon.
+    The hexagons keep their `index` (and neighbors) from the full file.
+
+    Parameters
+    ----------
+    geom: geopandas.GeoDataFrame
+        The hexagons, with an `h3_index` column.
+    folder: pathlib.Path
+    tile_res: int
+        H3 resolution of the tiles, coarser than the hexagons.
+    decimals, coord_decimals, compress:
+        As for `spider.formats.write_geojson`.
+
+    Returns: the manifest
+    """
+    if "h3_index" not in geom.columns:
+        raise ValueError("Need an 'h3_index' column to make tiles")
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    geom = geom.to_crs(4326)
+
+    tile = np.array([h3.cell_to_parent(c, tile_res) for c in geom["h3_index"]])
+    bounds = geom.geometry.bounds.groupby(tile)
+    bounds = pd.concat(
+        [bounds.minx.min(), bounds.miny.min(), bounds.maxx.max(), bounds.maxy.max()],
+        axis=1,
+    )
+    tiles = []
+    for cell, rows in pd.Series(np.arange(len(geom))).groupby(tile):
+        file = f"{cell}.geojson"
+        write_geojson(
+            geom.iloc[rows.to_numpy()],
+            folder / file,
+            decimals=decimals,
+            coord_decimals=coord_decimals,
+            compress=compress,
+        )
+        tiles.append(
+            {
+                "cell": cell,
+                "file": file,
+                "count": len(rows),
+                "bounds": [round(float(b), 6) for b in bounds.loc[cell]],
+            }
+        )
+
+    manifest = {
+        "tile_res": tile_res,
+        "count": len(geom),
+        "columns": column_stats(geom),
+        "tiles": tiles,
+    }
+    with (folder / "manifest.json").open("w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    return manifest
+
+
+def column_stats(geom: gpd.GeoDataFrame) -> dict:
+    """
+    Returns: the minimum and maximum of each numeric column
+    (None for columns without any values)
+    """
+    stats = {}
+    for col in geom.columns:
+        if col == geom.geometry.name or not pd.api.types.is_numeric_dtype(geom[col]):
+            continue
+        vals = geom[col].replace([np.inf, -np.inf], np.nan)
+        lo, hi = vals.min(), vals.max()
+        stats[col] = {
+            "min": None if pd.isna(lo) else lo.item(),
+            "max": None if pd.isna(hi) else hi.item(),
+        }
+    return stats
@@ -0,0 +1,296 @@
+from pathlib import Path
+from typing import Optional
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+import shapely
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.errors import WindowError
+from rasterio.features import rasterize
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import transform as window_transform
+from typer import echo
+
+from spider.cache import cache_path, hash_key, hex_key, tmp_path
+
+operations = ("sum", "mean", "max", "min", "count")
+
+# Overviews are averaged (or sampled) from the full raster, which keeps means
+# close but changes sums, counts and extremes
+overview_operations = ("mean",)
+
+# Number of (sub)pixels to rasterize at a time when building an index
+strip_pixels = 2**24
+
+
+class HexIndex:
+    """
+    Sparse mapping between hexagons and the pixels of a raster grid.
+
+    Pixels are stored as flat offsets into `window` and are sorted by hexagon,
+    so every zonal statistic is a single NumPy reduction over the pixel values.
+    `weight` is the fraction of each pixel covered by the hexagon, or None if
+    pixels are assigned to the hexagon containing their centre
+    (the same as rasterstats with `all_touched=False`).
+    """
+
+    def __init__(
+        self,
+        window: Window,
+        pixel: np.ndarray,
+        hex_id: np.ndarray,
+        n_hex: int,
+        weight: Optional[np.ndarray] = None,
+    ) -> None:
+        self.window = window
+        self.pixel = pixel
+        self.hex_id = hex_id
+        self.n_hex = n_hex
+        self.weight = weight
+
+        self.counts = np.bincount(hex_id, minlength=n_hex)
+        self.starts = np.cumsum(self.counts) - self.counts
+
+    def save(self, path: Path) -> None:
+        w = self.window
+        arrays = dict(
+            window=np.array([w.row_off, w.col_off, w.height, w.width]),
+            pixel=self.pixel,
+            hex_id=self.hex_id,
+            n_hex=np.array(self.n_hex),
+        )
+        if self.weight is not None:
+            arrays["weight"] = self.weight
+        tmp = tmp_path(path)
+        with tmp.open("wb") as f:
+            np.savez(f, **arrays)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "HexIndex":
+        with np.load(path) as f:
+            row_off, col_off, height, width = (int(x) for x in f["window"])
+            return cls(
+                window=Window(col_off, row_off, width, height),
+                pixel=f["pixel"],
+                hex_id=f["hex_id"],
+                n_hex=int(f["n_hex"]),
+                weight=f["weight"] if "weight" in f else None,
+            )
+
+    def reduce(
+        self, arr: np.ndarray, operation: str, nodata: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Calculate a zonal statistic for every hexagon.
+
+        Parameters
+        ----------
+        arr: numpy.ndarray
+            Raster values for `window` (can be a masked array).
+        operation: str
+            One of 'sum', 'mean', 'max', 'min' or 'count'.
+        nodata: float, optional
+            Value to ignore, in addition to masked and NaN pixels.
+
+        Returns: array with one value per hexagon, NaN where there are no valid
+        pixels (except for 'count').
+        """
+        mask = np.ma.getmaskarray(arr).ravel()[self.pixel]
+        vals = np.ma.getdata(arr).ravel()[self.pixel].astype("float64")
+        valid = ~mask & np.isfinite(vals)
+        if nodata is not None:
+            valid &= vals != nodata
+
+        weight = valid.astype("float64")
+        if self.weight is not None:
+            weight *= self.weight
+        count = np.bincount(self.hex_id, weights=weight, minlength=self.n_hex)
+        if operation == "count":
+            return count
+
+        out = np.full(self.n_hex, np.nan)
+        has = count > 0
+        if operation in ("sum", "mean"):
+            vals = np.where(valid, vals, 0) * weight
+            total = np.bincount(self.hex_id, weights=vals, minlength=self.n_hex)
+            out[has] = total[has] / count[has] if operation == "mean" else total[has]
+        elif operation in ("max", "min"):
+            ufunc = np.fmax if operation == "max" else np.fmin
+            vals = np.where(valid, vals, np.nan)
+            nonempty = self.counts > 0
+            reduced = np.full(self.n_hex, np.nan)
+            reduced[nonempty] = ufunc.reduceat(vals, self.starts[nonempty])
+            out[has] = reduced[has]
+        else:
+            raise NotImplementedError(f"Operation must be one of {operations}.")
+        return out
+
+
+def build_index(
+    geom: gpd.GeoDataFrame,
+    transform: Affine,
+    shape: tuple,
+    fractional: bool = False,
+    supersample: int = 4,
+) -> HexIndex:
+    """
+    Rasterize hexagons onto a raster grid to find the pixels in each one.
+
+    Only the window covering the hexagons is used, and it is rasterized in
+    strips of rows so memory stays bounded for very large grids.
+
+    Parameters
+    ----------
+    geom: geopandas.GeoDataFrame
+        The hex geometry, already in the raster's CRS.
+    transform: affine.Affine
+        The raster's transform.
+    shape: tuple
+        The raster's (height, width).
+    fractional: bool, optional (default False)
+        Weight pixels by the fraction of them covered by each hexagon,
+        estimated on a `supersample` times finer grid.
+    """
+    height, width = shape
+    full = Window(0, 0, width, height)
+    window = (
+        from_bounds(*geom.total_bounds, transform=transform)
+        .round_offsets(op="floor")
+        .round_lengths(op="ceil")
+    )
+    try:
+        window = window.intersection(full)
+    except WindowError:
+        # hexagons don't overlap the raster at all
+        window = Window(0, 0, 0, 0)
+    window = Window(
+        int(window.col_off), int(window.row_off), int(window.width), int(window.height)
+    )
+
+    k = supersample if fractional else 1
+    win_transform = window_transform(window, transform)
+    sub_transform = win_transform * Affine.scale(1 / k)
+    rows = max(1, strip_pixels // max(1, window.width * k * k))
+
+    sindex = geom.sindex
+    shapes = geom.geometry.values
+    pixels, hexes, weights = [], [], []
+    for row in range(0, window.height, rows):
+        n_rows = min(rows, window.height - row)
+        strip = Window(0, row, window.width, n_rows)
+        strip_transform = window_transform(strip, win_transform)
+        x0, y0 = strip_transform * (0, 0)
+        x1, y1 = strip_transform * (window.width, n_rows)
+        bounds = min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+        idx = sindex.query(shapely.box(*bounds))
+        if len(idx) == 0:
+            continue
+
+        labels = rasterize(
+            zip(shapes[idx], idx + 1),
+            out_shape=(n_rows * k, window.width * k),
+            transform=window_transform(Window(0, row * k, 0, 0), sub_transform),
+            fill=0,
+            all_touched=False,
+            dtype="int32",
+        )
+        sub_r, sub_c = np.nonzero(labels)
+        pixel = (sub_r // k + row) * window.width + sub_c // k
+        hex_id = labels[sub_r, sub_c].astype("int64") - 1
+        if fractional:
+            pair, count = np.unique(pixel * len(geom) + hex_id, return_counts=True)
+            pixel, hex_id = np.divmod(pair, len(geom))
+            weights.append((count / (k * k)).astype("float32"))
+        pixels.append(pixel)
+        hexes.append(hex_id)
+
+    pixel = np.concatenate(pixels) if pixels else np.zeros(0, dtype="int64")
+    hex_id = np.concatenate(hexes) if hexes else np.zeros(0, dtype="int64")
+    order = np.argsort(hex_id, kind="stable")
+    weight = None
+    if fractional:
+        weight = np.concatenate(weights)[order] if weights else np.zeros(0, "float32")
+    return HexIndex(window, pixel[order], hex_id[order], len(geom), weight)
+
+
+def get_index(
+    geom: gpd.GeoDataFrame,
+    crs: CRS,
+    transform: Affine,
+    shape: tuple,
+    cache_dir: Optional[Path] = None,
+    fractional: bool = False,
+) -> HexIndex:
+    """
+    Load the index for this hex geometry and raster grid from the cache,
+    or build it (and save it to the cache).
+
+    Parameters
+    ----------
+    geom: geopandas.GeoDataFrame
+        The hex geometry, already in the raster's CRS.
+    """
+    path = None
+    if cache_dir is not None:
+        key = hash_key(
+            "index", hex_key(geom), str(crs), tuple(transform), tuple(shape), fractional
+        )
+        path = cache_path(cache_dir, "index", key, ".npz")
+        if path.exists():
+            return HexIndex.load(path)
+
+    echo("Building hex-pixel index")
+    index = build_index(geom, transform, shape, fractional=fractional)
+    if path is not None:
+        index.save(path)
+    return index
+
+
+def overview_level(
+    ds: rasterio.DatasetReader,
+    geom: gpd.GeoDataFrame,
+    operation: str,
+    tolerance: float = 0.05,
+) -> Optional[int]:
+    """
+    Choose the coarsest overview of a raster that is accurate enough
+    for a zonal statistic over these hexagons.
+
+    Only pixels that cross a hexagon's edge can be given to the wrong hexagon,
+    and with pixels of width p these make up about 6ep / 2.6e² of a hexagon
+    with edges e. An overview is used if that is at most `tolerance` for the
+    smallest hexagon, so at most that share of each mean comes from pixels
+    only partly inside the hexagon.
+
+    Parameters
+    ----------
+    ds: rasterio.DatasetReader
+    geom: geopandas.GeoDataFrame
+        The hex geometry, already in the raster's CRS.
+    operation: str
+        Only 'mean' can use overviews: other operations return None.
+    tolerance: float, optional (default 0.05)
+        0 to always use the full resolution.
+
+    Returns: the overview level (index into `ds.overviews(1)`),
+    or None for the full resolution
+    """
+    factors = ds.overviews(1)
+    if operation not in overview_operations or not tolerance or not factors:
+        return None
+    areas = shapely.area(geom.geometry.values)
+    areas = areas[areas > 0]
+    if len(areas) == 0:
+        return None
+    area = areas.min()
+    edge = np.sqrt(area / (1.5 * np.sqrt(3)))
+    pixel = np.sqrt(abs(ds.transform.determinant))
+
+    level = None
+    for i, factor in enumerate(factors):
+        if 6 * edge * pixel * factor / area <= tolerance:
+            level = i
+    return level
@@ -0,0 +1,63 @@
+"""
+`tiled_distance` must match one distance transform over the whole grid:
+exactly up to `max_distance`, and otherwise within sqrt(2) * (k - 1) pixels.
+"""
+
+import math
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+from scipy import ndimage
+from shapely.geometry import LineString, Point
+
+from spider.edt import bytes_per_pixel, tiled_distance
+
+shape = (300, 400)
+px = 10.0
+affine = from_origin(0, shape[0] * px, px, px)
+options = dict(fill=1, default_value=0, all_touched=True)
+
+
+@pytest.fixture(scope="module")
+def vector() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        # vertices off the pixel corners, where all_touched burns depend on the window
+        geometry=[
+            LineString([(153.7, 2504.1), (1202.3, 2106.6), (1905.2, 2701.9)]),
+            LineString([(3303.3, 407.2), (3508.1, 1801.4)]),
+            Point(2604.4, 1503.3).buffer(31),
+        ]
+    )
+
+
+@pytest.fixture(scope="module")
+def full(vector: gpd.GeoDataFrame) -> np.ndarray:
+    grid = rasterize(vector.geometry, out_shape=shape, transform=affine, **options)
+    return ndimage.distance_transform_edt(grid) * px
+
+
+def test_exact_up_to_max_distance(vector: gpd.GeoDataFrame, full: np.ndarray) -> None:
+    max_distance = 400.0
+    out = np.zeros(shape, dtype="float32")
+    # small enough for several tiles, big enough for the halo
+    tiled_distance(
+        vector, affine, shape, out, memory=1, max_distance=max_distance, **options
+    )
+    np.testing.assert_allclose(out, np.minimum(full, max_distance), rtol=1e-6)
+
+
+def test_coarse_within_bound(vector: gpd.GeoDataFrame, full: np.ndarray) -> None:
+    memory = 1
+    out = np.zeros(shape, dtype="float32")
+    tiled_distance(vector, affine, shape, out, memory=memory, **options)
+    # the coarsening factor that tiled_distance uses for this memory
+    k = math.ceil(math.sqrt(shape[0] * shape[1] * bytes_per_pixel * 2 / 2**20))
+    assert k > 1
+    bound = math.sqrt(2) * (k - 1) * px
+    assert np.abs(out - full).max() <= bound + 1e-3
+    # pixels within the halo (32 pixels for this memory) are exact
+    near = full <= 30 * px
+    np.testing.assert_allclose(out[near], full[near], rtol=1e-6)
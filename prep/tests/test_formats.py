@@ -0,0 +1,41 @@
+"""
+`write_geojson` must write valid JSON (no NaN or Infinity) that reads back
+with the same values as the data it was given.
+"""
+
+import json
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from spider.formats import write_geojson
+
+
+def test_missing_and_infinite_values_are_null(tmp_path: Path) -> None:
+    geom = gpd.GeoDataFrame(
+        {
+            "a": [1.54, np.inf, -np.inf, np.nan],
+            "s": ["x", "y", None, "z"],
+            "i": [1, 2, 3, 4],
+        },
+        geometry=shapely.points([(0, 0), (1, 1), (2, 2), (3, 3)]),
+        crs=4326,
+    )
+    file = tmp_path / "hex.geojson"
+    write_geojson(geom, file, decimals={"a": 1}, chunk_size=3)
+
+    features = json.loads(file.read_text())["features"]
+    assert [f["properties"] for f in features] == [
+        {"a": 1.5, "s": "x", "i": 1},
+        {"a": None, "s": "y", "i": 2},
+        {"a": None, "s": None, "i": 3},
+        {"a": None, "s": "z", "i": 4},
+    ]
+    assert [f["geometry"]["coordinates"] for f in features] == [
+        [0, 0],
+        [1, 1],
+        [2, 2],
+        [3, 3],
+    ]
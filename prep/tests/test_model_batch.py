@@ -0,0 +1,86 @@
+"""
+`model_batch` must give the same results as running `model` on each hexagon,
+for the app data and for random slider values.
+"""
+
+from pathlib import Path
+from types import ModuleType
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+
+from spider.run import get_pars, load_app_config, load_model
+
+configs = Path(__file__).parents[2] / "frontend" / "dist" / "config"
+seeds = range(10)
+
+
+def sample_pars(cfg: dict, seed: int) -> dict:
+    """Random values within each slider's range (or from its categories)."""
+    rng = np.random.default_rng(seed)
+    pars = get_pars(cfg)
+    for p in cfg["pars"]:
+        if "cats" in p:
+            pars[p["col"]] = str(rng.choice(p["cats"]))
+        else:
+            pars[p["col"]] = float(rng.uniform(p["min"], p["max"]))
+    return pars
+
+
+def irri_towns(n: int = 500, seed: int = 0) -> pd.DataFrame:
+    """The irri app has no hex data, so make some."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "crop_extentmajority": rng.choice([0.0, 1.0, 2.0], n),
+            "cropyield": rng.gamma(2, 1, n),
+            "MarketDist": rng.uniform(0, 200, n),
+            "WTDmean": rng.uniform(0, 100, n),
+            "GridDist": rng.uniform(0, 50, n),
+        }
+    )
+
+
+def load_app(name: str) -> tuple:
+    cfg, app_dir = load_app_config(configs / f"{name}.yml")
+    model = load_model(app_dir / cfg["model"])
+    if name == "irri":
+        return cfg, model, irri_towns()
+    return cfg, model, gpd.read_file(app_dir / cfg["data"], ignore_geometry=True)
+
+
+@pytest.fixture(scope="module", params=["fish", "hydro", "irri"])
+def app(request: pytest.FixtureRequest) -> tuple:
+    return load_app(request.param)
+
+
+def assert_same(model: ModuleType, df: pd.DataFrame, pars: dict) -> None:
+    batch = model.model_batch({k: df[k].to_numpy() for k in df.columns}, pars)
+    scalar = [model.model(town, pars) for town in df.to_dict("records")]
+    assert set(batch) == set(scalar[0])
+    for col, values in batch.items():
+        expected = [res[col] for res in scalar]
+        assert len(values) == len(expected), col
+        if isinstance(expected[0], str):
+            assert list(values) == expected, col
+        else:
+            np.testing.assert_allclose(
+                np.asarray(values, dtype="float64"),
+                np.asarray(expected, dtype="float64"),
+                rtol=1e-9,
+                atol=1e-9,
+                err_msg=col,
+            )
+
+
+def test_defaults(app: tuple) -> None:
+    cfg, model, df = app
+    assert_same(model, df, get_pars(cfg))
+
+
+@pytest.mark.parametrize("seed", seeds)
+def test_random_pars(app: tuple, seed: int) -> None:
+    cfg, model, df = app
+    assert_same(model, df, sample_pars(cfg, seed))
@@ -0,0 +1,57 @@
+"""
+`add_neighbors` on two rings of res 2 hexagons around a pentagon, which cross
+icosahedron faces (where neighbors don't always share exact edges).
+"""
+
+import h3
+import numpy as np
+
+from spider.features import cells_to_hex
+from spider.neighbors import add_neighbors
+
+pentagon = "820807fffffffff"
+
+# each hexagon's neighbors, by index label (from 1, so 0 is only padding)
+expected = {
+    1: {2, 3, 4, 5, 6},
+    2: {1, 3, 6, 7, 8, 15},
+    3: {1, 2, 5, 8, 9, 10},
+    4: {1, 5, 6, 11, 12, 13},
+    5: {1, 3, 4, 9, 13, 14},
+    6: {1, 2, 4, 12, 15, 16},
+    7: {2, 8, 15},
+    8: {2, 3, 7, 10},
+    9: {3, 5, 10, 14},
+    10: {3, 8, 9},
+    11: {4, 12, 13},
+    12: {4, 6, 11, 16},
+    13: {4, 5, 11, 14},
+    14: {5, 9, 13},
+    15: {2, 6, 7, 16},
+    16: {6, 12, 15},
+}
+
+
+def test_neighbors_around_pentagon() -> None:
+    assert h3.is_pentagon(pentagon)
+    hexes = cells_to_hex(h3.grid_disk(pentagon, 2))
+    hexes.index = hexes.index + 1
+    assert hexes.loc[1, "h3_index"] == pentagon
+
+    nei = add_neighbors(hexes)[[f"n{i}" for i in range(6)]].to_numpy()
+    assert nei.dtype == np.int64
+    for label, row in zip(hexes.index, nei):
+        found = row[row != 0]
+        assert set(found) == expected[label]
+        # missing neighbors are padded with 0 at the end
+        assert (row[len(found) :] == 0).all()
+
+
+def test_neighbors_keep_the_index() -> None:
+    hexes = cells_to_hex(h3.grid_disk(pentagon, 2))
+    hexes.index = hexes.index + 1
+    shuffled = hexes.sample(frac=1, random_state=0)
+    nei = add_neighbors(shuffled)
+    assert (nei.index == shuffled.index).all()
+    for label, row in zip(nei.index, nei[[f"n{i}" for i in range(6)]].to_numpy()):
+        assert set(row[row != 0]) == expected[label]
@@ -0,0 +1,17 @@
+"""
+The app loads its own copy of propagate.py (it can't follow links outside
+frontend/dist), which must be kept the same as the one `spi draw` uses.
+"""
+
+from pathlib import Path
+
+root = Path(__file__).parents[2]
+
+
+def test_app_copy_is_the_same() -> None:
+    app = root / "frontend" / "dist" / "models" / "propagate.py"
+    prep = root / "prep" / "spider" / "propagate.py"
+    assert not app.is_symlink()
+    assert app.read_bytes() == prep.read_bytes(), (
+        "Copy prep/spider/propagate.py to frontend/dist/models/propagate.py"
+    )
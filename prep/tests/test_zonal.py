@@ -0,0 +1,43 @@
+"""
+The hex-pixel index must give the same zonal statistics as rasterstats.
+"""
+
+import h3
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from rasterio.transform import from_origin
+from rasterstats import zonal_stats
+
+from spider.features import cells_to_hex
+from spider.zonal import build_index, operations
+
+nodata = -9999.0
+
+
+@pytest.fixture(scope="module")
+def grid() -> tuple:
+    """
+    Hexagons around (0, 0), some sticking out past the raster, and a raster
+    with nodata and NaN pixels.
+    """
+    hexes = cells_to_hex(h3.grid_disk(h3.latlng_to_cell(0, 0, 6), 4))
+    rng = np.random.default_rng(0)
+    arr = rng.gamma(2, 10, (90, 110))
+    arr[rng.random(arr.shape) < 0.05] = nodata
+    arr[rng.random(arr.shape) < 0.02] = np.nan
+    transform = from_origin(-0.25, 0.2, 0.004, 0.004)
+    return hexes, arr, transform
+
+
+@pytest.mark.parametrize("operation", operations)
+def test_index_matches_zonal_stats(grid: tuple, operation: str) -> None:
+    hexes, arr, transform = grid
+    index = build_index(hexes, transform, arr.shape)
+    window = arr[index.window.toslices()]
+    got = index.reduce(np.ma.masked_equal(window, nodata), operation)
+
+    stats = zonal_stats(hexes, arr, affine=transform, nodata=nodata, stats=operation)
+    # rasterstats gives None (so NaN) where a hexagon has no valid pixels
+    want = np.array([s[operation] for s in stats], dtype="float64")
+    assert_allclose(got, want, rtol=1e-9)